@@ -0,0 +1,60 @@
+# 压测用的 Bot 进程, 由 bench/loadtest.py 启动
+#
+# 在临时目录中运行真实的 core, 只把 QQ 空间换成假的实现, 可选用固定图片代替渲染
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeQzone:
+    async def upload_raw_image(self, album_name: str, file_path: list[str]):
+        await asyncio.sleep(0.2)
+        return [f"fake-{os.path.basename(os.path.dirname(p))}" for p in file_path]
+
+    async def get_album(self, name: str):
+        return "fake-album"
+
+    async def get_image(self, album_id, name: str):
+        return name
+
+    async def delete_image(self, image):
+        pass
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument("--fake-render", action="store_true")
+    args = parser.parse_args()
+
+    os.chdir(args.workdir)
+    sys.path.insert(0, os.path.join(ROOT, "src"))
+
+    import core
+    import image
+    import main
+
+    async def get_qzone():
+        return FakeQzone()
+
+    core.bot.get_qzone = get_qzone
+
+    if args.fake_render:
+
+        async def generate_img(id, user, anonymous, contents, admin=False):
+            path = f"./data/{id}/image.png"
+            shutil.copy(os.path.join(ROOT, "help", "feedback.png"), path)
+            return [os.path.abspath(path)]
+
+        image.generate_img = generate_img
+
+    asyncio.run(main.main())
+
+
+if __name__ == "__main__":
+    run()
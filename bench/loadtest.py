@@ -0,0 +1,294 @@
+# 压测: 本地假 OneBot 11 服务端 + 大量模拟用户
+#
+#   uv run bench/loadtest.py -u 1000 --ramp 60
+#   uv run bench/loadtest.py -u 200 --fake-render -e OUTBOX_RATE=0
+#
+# 启动一个正向 WebSocket 服务端代替 NapCat, 再以子进程运行真实的 Bot 连接过来
+# (QQ 空间换成假的实现). 每个模拟用户依次执行
+#   #投稿 -> 发送内容 -> #结束 -> #确认 -> 管理员贴表情通过
+# 记录每一步从发出事件到收到 Bot 私聊回复的延迟, 最后输出吞吐量和延迟分位数.
+# 依赖 websockets.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SELF_ID = 10000
+ADMIN_ID = 10001
+GROUP_ID = 20000
+USER_BASE = 3000000000
+
+
+class FakeOneBot:
+    def __init__(self):
+        self.connections = set()
+        self.connected = asyncio.Event()
+        self.message_ids = itertools.count(1)
+        # 用户 QQ -> 等待回复的 (关键字, future)
+        self.waiters: dict[int, list[tuple[str, asyncio.Future]]] = defaultdict(list)
+        self.actions: dict[str, int] = defaultdict(int)
+        # 用户 QQ -> 管理员贴表情的时间
+        self.approved_at: dict[int, float] = {}
+        self.sent = 0
+
+    async def handler(self, ws):
+        self.connections.add(ws)
+        self.connected.set()
+        await ws.send(
+            json.dumps(
+                {
+                    "time": int(time.time()),
+                    "self_id": SELF_ID,
+                    "post_type": "meta_event",
+                    "meta_event_type": "lifecycle",
+                    "sub_type": "connect",
+                }
+            )
+        )
+        try:
+            async for raw in ws:
+                request = json.loads(raw)
+                data = await self.call(request["action"], request.get("params") or {})
+                await ws.send(
+                    json.dumps(
+                        {
+                            "status": "ok",
+                            "retcode": 0,
+                            "data": data,
+                            "echo": request.get("echo"),
+                        }
+                    )
+                )
+        finally:
+            self.connections.discard(ws)
+
+    async def push(self, event: dict):
+        event = {"time": int(time.time()), "self_id": SELF_ID, **event}
+        raw = json.dumps(event)
+        for ws in list(self.connections):
+            await ws.send(raw)
+        self.sent += 1
+
+    def wait_reply(self, user_id: int, keyword: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[user_id].append((keyword, future))
+        return future
+
+    def _deliver(self, user_id: int, text: str):
+        for item in list(self.waiters.get(user_id, [])):
+            keyword, future = item
+            if keyword in text and not future.done():
+                future.set_result(time.perf_counter())
+                self.waiters[user_id].remove(item)
+
+    async def call(self, action: str, params: dict):
+        self.actions[action] += 1
+        match action:
+            case "get_login_info":
+                return {"user_id": SELF_ID, "nickname": "Nishikigi"}
+            case "get_group_member_list":
+                return [{"user_id": ADMIN_ID, "nickname": "admin", "role": "owner"}]
+            case "get_clientkey":
+                return {"clientkey": "fake"}
+            case "get_cookies":
+                return {"cookies": "uin=o10000; skey=fake; p_skey=fake"}
+            case "get_credentials":
+                return {"cookies": "uin=o10000; skey=fake", "token": 0}
+            case "send_private_msg" | "send_group_msg" | "send_msg":
+                message_id = next(self.message_ids)
+                text = _text(params.get("message"))
+                if "user_id" in params and action != "send_group_msg":
+                    self._deliver(int(params["user_id"]), text)
+                else:
+                    self._on_group(message_id, text)
+                return {"message_id": message_id}
+            case _:
+                # set_msg_emoji_like / set_input_status / set_group_card 等
+                return None
+
+    def _on_group(self, message_id: int, text: str):
+        # 新投稿进入审核群后, 由管理员贴表情通过
+        if "若同意通过该投稿" not in text:
+            return
+        users = [int(n) for n in re.findall(r"\d+", text) if int(n) >= USER_BASE]
+        if not users:
+            return
+        asyncio.get_running_loop().call_later(
+            0.05,
+            lambda: asyncio.ensure_future(self.approve(users[0], message_id)),
+        )
+
+    async def approve(self, user_id: int, message_id: int):
+        # 通过这一步的延迟从贴表情开始计算
+        self.approved_at[user_id] = time.perf_counter()
+        await self.push(
+            {
+                "post_type": "notice",
+                "notice_type": "group_msg_emoji_like",
+                "group_id": GROUP_ID,
+                "user_id": ADMIN_ID,
+                "message_id": message_id,
+                "likes": [{"emoji_id": 201, "count": 1}],
+                "is_add": True,
+            }
+        )
+
+
+def _text(message) -> str:
+    if isinstance(message, str):
+        return message
+    return "".join(str(seg.get("data", {}).get("text", "")) for seg in message or [])
+
+
+class User:
+    def __init__(self, server: FakeOneBot, index: int):
+        self.server = server
+        self.user_id = USER_BASE + index
+        self.nickname = f"压测用户{index}"
+
+    async def send(self, message: list[dict]):
+        raw = "".join(
+            s["data"]["text"] if s["type"] == "text" else f"[CQ:{s['type']}]"
+            for s in message
+        )
+        await self.server.push(
+            {
+                "post_type": "message",
+                "message_type": "private",
+                "sub_type": "friend",
+                "message_id": next(self.server.message_ids),
+                "user_id": self.user_id,
+                "message": message,
+                "message_format": "array",
+                "raw_message": raw,
+                "font": 14,
+                "sender": {"user_id": self.user_id, "nickname": self.nickname},
+            }
+        )
+
+    async def step(self, text: str | None, keyword: str, timeout: float) -> float:
+        future = self.server.wait_reply(self.user_id, keyword)
+        start = time.perf_counter()
+        if text is not None:
+            await self.send([{"type": "text", "data": {"text": text}}])
+        return await asyncio.wait_for(future, timeout) - start
+
+    async def run(self, timeout: float) -> dict[str, float]:
+        latencies = {}
+        latencies["投稿"] = await self.step("#投稿", "开始投稿", timeout)
+        await self.send(
+            [
+                {"type": "text", "data": {"text": f"压测内容 {self.user_id}\n"}},
+                {"type": "face", "data": {"id": str(random.randint(0, 300))}},
+            ]
+        )
+        latencies["结束"] = await self.step("#结束", "这样投稿可以吗", timeout)
+        # 通过的通知要等管理员贴表情, 在发送 #确认 之前就开始等待
+        approved = self.server.wait_reply(self.user_id, "已通过审核")
+        latencies["确认"] = await self.step("#确认", "已成功投稿", timeout)
+        done = await asyncio.wait_for(approved, timeout)
+        latencies["通过"] = done - self.server.approved_at[self.user_id]
+        return latencies
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    k = (len(values) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+async def run(args) -> int:
+    server = FakeOneBot()
+    async with websockets.serve(server.handler, "localhost", args.port):
+        with tempfile.TemporaryDirectory(prefix="nishikigi-load-") as tmp:
+            for name in ("templates", "face", "help"):
+                os.symlink(os.path.join(ROOT, name), os.path.join(tmp, name))
+            os.makedirs(os.path.join(tmp, "data"))
+            env = {
+                **os.environ,
+                "WS_URL": f"ws://localhost:{args.port}",
+                "GROUP": str(GROUP_ID),
+                "ACCESS_TOKEN": "",
+                "QUEUE": str(args.queue),
+                **dict(e.split("=", 1) for e in args.env),
+            }
+            command = [sys.executable, os.path.join(ROOT, "bench", "loadbot.py")]
+            command += ["--workdir", tmp] + (["--fake-render"] * args.fake_render)
+            bot = subprocess.Popen(command, env=env)
+            try:
+                await asyncio.wait_for(server.connected.wait(), 60)
+                await asyncio.sleep(1)
+                return await drive(server, args)
+            finally:
+                bot.terminate()
+                bot.wait(10)
+
+
+async def drive(server: FakeOneBot, args) -> int:
+    results: list[dict[str, float]] = []
+    failures = 0
+
+    async def user(index: int):
+        nonlocal failures
+        await asyncio.sleep(args.ramp * index / args.users)
+        try:
+            results.append(await User(server, index).run(args.timeout))
+        except asyncio.TimeoutError:
+            failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - start
+
+    print(f"用户数 {args.users}, 完成 {len(results)}, 超时 {failures}")
+    print(f"总耗时 {elapsed:.1f}s, 吞吐量 {len(results) / elapsed:.2f} 投稿/s")
+    print(f"推送事件 {server.sent}, Bot 调用 {sum(server.actions.values())}")
+    print(f"{'step':<6}{'p50(s)':>10}{'p95(s)':>10}{'p99(s)':>10}{'max(s)':>10}")
+    for step in ("投稿", "结束", "确认", "通过"):
+        values = [r[step] for r in results]
+        if not values:
+            continue
+        print(
+            f"{step:<6}{percentile(values, 0.5):>10.3f}{percentile(values, 0.95):>10.3f}"
+            f"{percentile(values, 0.99):>10.3f}{max(values):>10.3f}"
+        )
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nishikigi 压测")
+    parser.add_argument("-u", "--users", type=int, default=100, help="模拟用户数")
+    parser.add_argument("--ramp", type=float, default=10, help="在多少秒内启动全部用户")
+    parser.add_argument("--timeout", type=float, default=300, help="每一步的超时")
+    parser.add_argument("--port", type=int, default=16666)
+    parser.add_argument("--queue", type=int, default=4, help="Bot 的 QUEUE 配置")
+    parser.add_argument(
+        "--fake-render", action="store_true", help="用固定图片代替 Chromium 渲染"
+    )
+    parser.add_argument(
+        "-e",
+        "--env",
+        action="append",
+        default=[],
+        help="传给 Bot 的环境变量, 如 -e OUTBOX_RATE=0",
+    )
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# 预览图渲染基准测试, 不需要网络和 Bot 连接
+#
+#   uv run bench/preview.py                 运行并与 bench/baseline.json 比较
+#   uv run bench/preview.py --save          运行并保存为新的基线
+#   uv run bench/preview.py -s photos -n 10 只跑某个场景, 每个场景 10 次
+#
+# 每个场景报告 p50/p95 耗时、渲染期间进程树(含 Chromium)的峰值 RSS 和输出图片大小
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def text(s: str) -> dict:
+    return {"type": "text", "data": {"text": s}}
+
+
+def face(id: int) -> dict:
+    return {"type": "face", "data": {"id": str(id)}}
+
+
+def photo(file: str, sticker: bool = False) -> dict:
+    return {"type": "image", "data": {"file": file, "sub_type": 1 if sticker else 0}}
+
+
+PARAGRAPH = (
+    "今天在图书馆三楼捡到一张校园卡, 失主请联系我。顺便吐槽一下食堂的饭越来越贵了😭\n"
+)
+
+
+def scenarios() -> dict[str, list]:
+    faces = [
+        int(f[:-4])
+        for f in os.listdir(os.path.join(ROOT, "face"))
+        if f.endswith(".png")
+    ]
+    rng = random.Random(0)
+    return {
+        "text": [[text(PARAGRAPH * 3)] for _ in range(5)],
+        "faces": [
+            [text("表情测试"), *[face(rng.choice(faces)) for _ in range(40)]]
+            for _ in range(5)
+        ],
+        "photos": [[photo(f"photo{i % 4}.jpg")] for i in range(12)]
+        + [[photo(f"sticker{i % 2}.png", sticker=True)] for i in range(4)],
+        "long": [
+            [text(PARAGRAPH)] if i % 3 else [photo(f"photo{i % 4}.jpg")]
+            for i in range(150)
+        ],
+    }
+
+
+def make_fixtures(path: str):
+    # 生成固定的测试图片, 保证每次运行的输入一致
+    from PIL import Image
+
+    rng = random.Random(0)
+    os.makedirs(path, exist_ok=True)
+    for i in range(4):
+        img = Image.radial_gradient("L").resize((1920, 1440)).convert("RGB")
+        noise = Image.effect_noise((1920, 1440), 64).convert("RGB")
+        img = Image.blend(img, noise, 0.3 + 0.1 * i)
+        img.save(os.path.join(path, f"photo{i}.jpg"), quality=90)
+    for i in range(2):
+        color = tuple(rng.randrange(256) for _ in range(3))
+        Image.new("RGB", (240, 240), color).save(os.path.join(path, f"sticker{i}.png"))
+
+
+def tree_rss(root: int) -> int:
+    # 统计 root 及其所有子进程的 RSS, Chromium 的内存也算在内
+    children = defaultdict(list)
+    rss = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{entry}/statm") as f:
+                pages = int(f.read().split()[1])
+        except OSError:
+            continue
+        ppid = int(stat[stat.rindex(")") + 2 :].split()[1])
+        children[ppid].append(int(entry))
+        rss[int(entry)] = pages * PAGE_SIZE
+    total, stack = 0, [root]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children[pid])
+    return total
+
+
+class PeakSampler(threading.Thread):
+    def __init__(self, interval: float = 0.02):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def reset(self):
+        self.peak = 0
+
+    def run(self):
+        pid = os.getpid()
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, tree_rss(pid))
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    k = (len(values) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+async def run(names: list[str], runs: int) -> dict[str, dict]:
+    import image
+
+    sampler = PeakSampler()
+    sampler.start()
+    results = {}
+    try:
+        for id, name in enumerate(names, start=1):
+            contents = scenarios()[name]
+            os.makedirs(f"./data/{id}", exist_ok=True)
+            for file in os.listdir("fixtures"):
+                shutil.copy(os.path.join("fixtures", file), f"./data/{id}/{file}")
+            job = {
+                "id": id,
+                "user_id": 10000,
+                "nickname": "基准测试",
+                "anonymous": False,
+                "contents": contents,
+                "admin": False,
+                "offline": True,
+            }
+
+            # 预热一次, 不计入结果(包括启动浏览器)
+            await image.run_job(job)
+
+            sampler.reset()
+            latencies = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                result = await image.run_job(job)
+                latencies.append(time.perf_counter() - start)
+            results[name] = {
+                "p50": percentile(latencies, 0.5),
+                "p95": percentile(latencies, 0.95),
+                "peak_rss": sampler.peak,
+                "size": sum(os.path.getsize(p) for p in result["paths"]),
+                "tiles": len(result["paths"]),
+            }
+    finally:
+        sampler.stopped.set()
+        await image.close()
+    return results
+
+
+def report(results: dict[str, dict], baseline: dict[str, dict] | None, threshold):
+    regressed = []
+    print(
+        f"{'scenario':<10}{'p50(s)':>10}{'p95(s)':>10}{'rss(MiB)':>12}"
+        f"{'size(KiB)':>12}{'tiles':>7}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<10}{r['p50']:>10.3f}{r['p95']:>10.3f}"
+            f"{r['peak_rss'] / 2**20:>12.1f}{r['size'] / 2**10:>12.1f}{r['tiles']:>7}"
+        )
+        base = (baseline or {}).get(name)
+        if not base:
+            continue
+        deltas = []
+        for key in ("p50", "p95", "peak_rss", "size"):
+            change = (r[key] - base[key]) / base[key] if base[key] else 0.0
+            deltas.append(f"{key} {change:+.1%}")
+            if key in ("p95", "peak_rss") and change > threshold:
+                regressed.append(f"{name} {key}")
+        print(f"{'':<10}对比基线: {', '.join(deltas)}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预览图渲染基准测试")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="每个场景的次数")
+    parser.add_argument(
+        "-s", "--scenario", action="append", choices=list(scenarios()), help="场景"
+    )
+    parser.add_argument("--save", action="store_true", help="保存为新的基线")
+    parser.add_argument("--baseline", default=BASELINE, help="基线文件路径")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="p95 或 RSS 超过基线多少算退化"
+    )
+    args = parser.parse_args()
+
+    names = args.scenario or list(scenarios())
+    with tempfile.TemporaryDirectory(prefix="nishikigi-bench-") as tmp:
+        # 在临时目录里运行, 不碰真实的 data/
+        os.symlink(os.path.join(ROOT, "templates"), os.path.join(tmp, "templates"))
+        os.symlink(os.path.join(ROOT, "face"), os.path.join(tmp, "face"))
+        make_fixtures(os.path.join(tmp, "fixtures"))
+        os.chdir(tmp)
+        results = asyncio.run(run(names, args.runs))
+        os.chdir(ROOT)
+
+    baseline = None
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressed = report(results, None if args.save else baseline, args.threshold)
+
+    if args.save:
+        with open(args.baseline, mode="w") as f:
+            json.dump({**(baseline or {}), **results}, f, indent=2)
+        print(f"已保存基线到 {args.baseline}")
+    elif regressed:
+        print(f"性能退化: {', '.join(regressed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
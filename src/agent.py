@@ -1,8 +1,29 @@
 import json
-import httpx
+import time
 from botx.models import PrivateMessage
 
 import config
+import metrics
+import tracing
+
+# 请求 LLM 的客户端, 复用连接. 启动后在后台创建, 见 main.py
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        import httpx
+
+        _client = httpx.AsyncClient(timeout=15.0)
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
 
 
 def is_known_command(raw: str) -> bool:
@@ -81,51 +102,41 @@ async def ai_suggest_intent(raw: str) -> dict:
     }
 
     resp_obj = {"intent_candidates": []}
+    began = time.perf_counter()
     try:
         url = config.AGENT_ROUTER_BASE.rstrip("/") + "/v1/chat/completions"
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.post(url, headers=headers, json=body)
-            r.raise_for_status()
-            j = r.json()
-            text = ""
-            if "choices" in j and len(j["choices"]) > 0:
-                cand = j["choices"][0]
-                if (
-                    isinstance(cand, dict)
-                    and "message" in cand
-                    and isinstance(cand["message"], dict)
-                ):
-                    text = cand["message"].get("content", "") or ""
-                else:
-                    text = cand.get("text", "") or ""
-            if not text and "text" in j:
-                text = j.get("text", "")
-
-            # 尝试解析 JSON
-            try:
-                parsed = json.loads(text)
-                resp_obj = parsed
-            except Exception:
-                # 尝试提取文本中的 JSON 块
-                start = text.find("{")
-                end = text.rfind("}")
-                if start != -1 and end != -1 and end > start:
-                    snippet = text[start : end + 1]
-                    try:
-                        parsed = json.loads(snippet)
-                        resp_obj = parsed
-                    except Exception:
-                        resp_obj = {
-                            "intent_candidates": [
-                                {
-                                    "label": "无法结构化解析",
-                                    "suggestion": "",
-                                    "confidence": "低",
-                                    "reason": text[:400],
-                                }
-                            ]
-                        }
-                else:
+        with tracing.span("llm"):
+            r = await get_client().post(url, headers=headers, json=body)
+        r.raise_for_status()
+        j = r.json()
+        text = ""
+        if "choices" in j and len(j["choices"]) > 0:
+            cand = j["choices"][0]
+            if (
+                isinstance(cand, dict)
+                and "message" in cand
+                and isinstance(cand["message"], dict)
+            ):
+                text = cand["message"].get("content", "") or ""
+            else:
+                text = cand.get("text", "") or ""
+        if not text and "text" in j:
+            text = j.get("text", "")
+
+        # 尝试解析 JSON
+        try:
+            parsed = json.loads(text)
+            resp_obj = parsed
+        except Exception:
+            # 尝试提取文本中的 JSON 块
+            start = text.find("{")
+            end = text.rfind("}")
+            if start != -1 and end != -1 and end > start:
+                snippet = text[start : end + 1]
+                try:
+                    parsed = json.loads(snippet)
+                    resp_obj = parsed
+                except Exception:
                     resp_obj = {
                         "intent_candidates": [
                             {
@@ -136,23 +147,40 @@ async def ai_suggest_intent(raw: str) -> dict:
                             }
                         ]
                     }
+            else:
+                resp_obj = {
+                    "intent_candidates": [
+                        {
+                            "label": "无法结构化解析",
+                            "suggestion": "",
+                            "confidence": "低",
+                            "reason": text[:400],
+                        }
+                    ]
+                }
     except Exception as e:
         from core import bot
 
+        metrics.llm_errors.inc()
         bot.getLogger().warning(f"AI call failed: {e}")
         resp_obj = {"intent_candidates": []}
+    finally:
+        metrics.llm_seconds.observe(time.perf_counter() - began)
 
     return resp_obj
 
 
 async def reply_ai_suggestions(msg: PrivateMessage, ai_result: dict):
+    from core import outbox
+
     candidates = (
         ai_result.get("intent_candidates", []) if isinstance(ai_result, dict) else []
     )
 
     if not candidates:
-        await msg.reply(
-            "抱歉, 我没理解你想做什么😵‍💫\n请尝试简短说明你的目标, 例如:  “我要匿名投稿”\n或者发送:  \n\n#帮助\n\n来查看操作指引\n\n若一直返回此提示可能是AI功能繁忙, 请稍等后重新发送"
+        await outbox.reply(
+            msg,
+            "抱歉, 我没理解你想做什么😵‍💫\n请尝试简短说明你的目标, 例如:  “我要匿名投稿”\n或者发送:  \n\n#帮助\n\n来查看操作指引\n\n若一直返回此提示可能是AI功能繁忙, 请稍等后重新发送",
         )
         return
 
@@ -167,17 +195,19 @@ async def reply_ai_suggestions(msg: PrivateMessage, ai_result: dict):
         if reason:
             msg_text += f"\n\n说明: {reason[:200]}"  # 保留更多信息
         msg_text += "\n\n直接发送命令即可执行, 或简要描述你的问题! (例如 我要投稿)"
-        await msg.reply(msg_text)
+        await outbox.reply(msg, msg_text)
     else:
         # 没有 suggestion, 则直接回复 reason
         reason_texts = [c.get("reason") for c in candidates if c.get("reason")]
         if reason_texts:
-            await msg.reply(
+            await outbox.reply(
+                msg,
                 "🤖 建议:\n\n"
                 + "\n\n".join(reason_texts)
-                + "\n\n或简单描述您的需求, 我将为您提供建议! (例如 我要投稿)"
+                + "\n\n或简单描述您的需求, 我将为您提供建议! (例如 我要投稿)",
             )
         else:
-            await msg.reply(
-                "抱歉, 我无法生成命令😵‍💫\n请尝试简短描述你的需求或发送: \n\n#帮助\n\n查看操作指引\n\n若一直返回此提示可能是AI功能繁忙, 请稍等后重新发送"
+            await outbox.reply(
+                msg,
+                "抱歉, 我无法生成命令😵‍💫\n请尝试简短描述你的需求或发送: \n\n#帮助\n\n查看操作指引\n\n若一直返回此提示可能是AI功能繁忙, 请稍等后重新发送",
             )
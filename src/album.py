@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+
+# 缓存 QQ 空间的客户端和相册 ID.
+# upload_raw_image 只返回图片名, 删除时仍需用 get_image 按名字查找图片
+class Album:
+    def __init__(self, bot, name: str, ttl: float):
+        self.bot = bot
+        self.name = name
+        self.ttl = ttl
+        self._client = None
+        self._expires = 0.0
+        self._album_id = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        # 出错时可能是登录失效, 下次重新获取客户端和相册
+        self._client = None
+        self._album_id = None
+
+    async def client(self):
+        async with self._lock:
+            if self._client is None or time.monotonic() > self._expires:
+                self._client = await self.bot.get_qzone()
+                self._expires = time.monotonic() + self.ttl
+            return self._client
+
+    async def album_id(self):
+        if self._album_id is None:
+            # 找不到相册时不缓存, 下次再试
+            self._album_id = await (await self.client()).get_album(self.name)
+        return self._album_id
+
+    async def upload(self, paths: list[str]) -> list[str]:
+        try:
+            return await (await self.client()).upload_raw_image(
+                album_name=self.name, file_path=paths
+            )
+        except Exception:
+            self.invalidate()
+            raise
+
+    async def get_image(self, name: str):
+        album = await self.album_id()
+        if album is None:
+            return None
+        return await (await self.client()).get_image(album_id=album, name=name)
+
+    async def delete(self, names: list[str]) -> list[str]:
+        # 返回找不到的图片名
+        missing = []
+        try:
+            for name in names:
+                image = await self.get_image(name)
+                if image is None:
+                    missing.append(name)
+                    continue
+                await (await self.client()).delete_image(image)
+        except Exception:
+            self.invalidate()
+            raise
+        return missing
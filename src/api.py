@@ -0,0 +1,106 @@
+import hashlib
+import json
+import time
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+
+import config
+import image
+import repo
+from models import Article, Status
+
+# 只读的管理接口, 给外部面板轮询用. 鉴权在 core 中 include_router 时统一加上
+router = APIRouter(prefix="/api")
+
+# 请求 URL -> (过期时间, ETag, 响应体)
+_cache: dict[str, tuple[float, str, bytes]] = {}
+
+
+def _file_url(path: str, width: int | None = None) -> str:
+    # core 导入了本模块, 这里延迟导入避免循环
+    from core import get_file_url
+
+    return get_file_url(path, width)
+
+
+def thumbnail(id: int) -> str | None:
+    images = image.get_images(id)
+    return _file_url(images[0], 360) if images else None
+
+
+def summary(article: Article) -> dict:
+    return {
+        "id": article.id,
+        "sender_id": article.sender_id,
+        "sender_name": article.sender_name,
+        "anonymous": article.anonymous,
+        "single": article.single,
+        "status": article.status.value,
+        "time": int(article.time.timestamp()),
+    }
+
+
+def detail(article: Article) -> dict:
+    return {
+        **summary(article),
+        "approve": article.approve.split(",") if article.approve else [],
+        "tid": article.tid,
+        "images": [_file_url(path) for path in image.get_images(article.id)],
+        "thumbnail": thumbnail(article.id),
+    }
+
+
+async def _cached(request: Request, load) -> Response:
+    key = str(request.url)
+    now = time.monotonic()
+    entry = _cache.get(key)
+    if entry is None or entry[0] < now:
+        body = json.dumps(await load(), ensure_ascii=False).encode()
+        entry = (
+            now + config.API_CACHE_TTL,
+            f'"{hashlib.sha1(body).hexdigest()}"',
+            body,
+        )
+        # 顺便清理过期的缓存
+        for k in [k for k, v in _cache.items() if v[0] < now]:
+            del _cache[k]
+        _cache[key] = entry
+
+    _, etag, body = entry
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={int(config.API_CACHE_TTL)}",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.get("/articles")
+async def list_articles(
+    request: Request,
+    status: Status | None = None,
+    page: int = Query(1, ge=1),
+    size: int = Query(20, ge=1, le=100),
+):
+    async def load():
+        total, articles = await repo.page_articles(status, (page - 1) * size, size)
+        return {
+            "total": total,
+            "page": page,
+            "size": size,
+            "items": [{**summary(a), "thumbnail": thumbnail(a.id)} for a in articles],
+        }
+
+    return await _cached(request, load)
+
+
+@router.get("/articles/{id}")
+async def get_article(request: Request, id: int):
+    async def load():
+        article = await repo.get_article(id)
+        if article is None:
+            raise HTTPException(status_code=404, detail=f"投稿 #{id} 不存在")
+        return detail(article)
+
+    return await _cached(request, load)
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import re
+import shutil
+import uuid
+
+import metrics
+
+# 按 OneBot 的 file 名(图片内容的哈希)存放图片, 投稿目录中的图片是指向这里的硬链接.
+# 硬链接数就是引用计数, 只剩 blobs 中这一份时即可删除.
+ROOT = "./data/blobs"
+
+hits = metrics.Counter("nishikigi_blob_hits_total", "已存在而跳过下载的图片数")
+
+# 正在下载的图片, 同一张图片同时只下载一次
+_downloads: dict[str, asyncio.Task] = {}
+
+
+def blob_path(key: str) -> str:
+    key = re.sub(r"[^\w.\-]", "_", os.path.basename(key))
+    return f"{ROOT}/{key[:2]}/{key}"
+
+
+async def _download(url: str, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写到临时文件, 避免留下下载了一半的图片
+    tmp = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        import httpx
+
+        with metrics.stage_seconds.time(stage="download"):
+            async with httpx.AsyncClient(timeout=60) as client:
+                async with client.stream("GET", url) as resp:
+                    resp.raise_for_status()
+                    with open(tmp, mode="bw") as file:
+                        async for chunk in resp.aiter_bytes():
+                            file.write(chunk)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+async def fetch(key: str, url: str) -> str:
+    path = blob_path(key)
+    if os.path.isfile(path):
+        hits.inc()
+        return path
+    if key not in _downloads:
+        task = asyncio.create_task(_download(url, path))
+        _downloads[key] = task
+        task.add_done_callback(lambda _: _downloads.pop(key, None))
+    await asyncio.shield(_downloads[key])
+    return path
+
+
+async def store(key: str, url: str, dest: str) -> bool:
+    # 把图片放到 dest, 返回是否真的下载了
+    downloaded = False
+    while True:
+        if not os.path.isfile(blob_path(key)):
+            downloaded = True
+        path = await fetch(key, url)
+        try:
+            link(path, dest)
+            return downloaded
+        except FileNotFoundError:
+            if not os.path.isdir(os.path.dirname(dest)):
+                raise
+            # 等待期间被其他投稿释放了, 重新下载
+            continue
+
+
+def link(path: str, dest: str):
+    if os.path.exists(dest):
+        return
+    try:
+        os.link(path, dest)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # 不支持硬链接的文件系统只能复制, 此时不再共享存储
+        shutil.copyfile(path, dest)
+
+
+def release(key: str):
+    path = blob_path(key)
+    try:
+        if os.stat(path).st_nlink <= 1:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_article(id: int | str):
+    dir = f"./data/{id}"
+    if not os.path.isdir(dir):
+        return
+    names = os.listdir(dir)
+    shutil.rmtree(dir)
+    for name in names:
+        release(name)
+
+
+def gc() -> int:
+    # 清理没有被任何投稿引用的图片(例如程序中途退出时留下的)
+    removed = 0
+    if not os.path.isdir(ROOT):
+        return removed
+    for prefix in os.listdir(ROOT):
+        for name in os.listdir(f"{ROOT}/{prefix}"):
+            path = f"{ROOT}/{prefix}/{name}"
+            if name.endswith(".part") or name in _downloads:
+                continue
+            if os.stat(path).st_nlink <= 1:
+                os.remove(path)
+                removed += 1
+    return removed
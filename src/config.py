@@ -22,3 +22,65 @@ STATUS_ID = [400, 382, 383, 401, 400, 380, 381, 379, 376, 378, 377, 336]
 AGENT_ROUTER_BASE = os.getenv("AGENT_ROUTER_BASE", "")
 AGENT_ROUTER_KEY = os.getenv("AGENT_ROUTER_KEY", "")
 AGENT_MODEL = os.getenv("AGENT_MODEL", "gpt-4o-mini")
+
+# 渲染进程数量. 每个进程常驻一个 Chromium(约 150 MB 以上), 投稿多时再调大
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", 1))
+# 单次渲染的超时时间(秒)和失败后换进程重试的次数
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", 120))
+RENDER_RETRY = int(os.getenv("RENDER_RETRY", 1))
+
+# 长投稿按此高度(CSS 像素)分段截图并作为多张图片发布, 0 表示不分段
+TILE_HEIGHT = int(os.getenv("TILE_HEIGHT", 2400))
+
+# 批量通知用户时每秒最多发送的消息数和同时进行的请求数.
+# 实际速度还受 OUTBOX_RATE 限制, 默认两者相同, 此时并发只在单次请求
+# 耗时超过发送间隔(1 / NOTIFY_RATE 秒)时才有作用, 需要更快时两者一起调大
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", 2))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", 4))
+
+# 发送消息的总频率(每秒), 以及各类消息各自的上限, 0 表示不单独限制
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", 2))
+OUTBOX_INTERACTIVE_RATE = float(os.getenv("OUTBOX_INTERACTIVE_RATE", 0))
+OUTBOX_ADMIN_RATE = float(os.getenv("OUTBOX_ADMIN_RATE", 1))
+OUTBOX_COSMETIC_RATE = float(os.getenv("OUTBOX_COSMETIC_RATE", 0.5))
+# 输入状态等只在当下有意义的调用排队超过这个时间(秒)就丢弃, 群名片等状态总会发出最新的值
+OUTBOX_COSMETIC_TTL = float(os.getenv("OUTBOX_COSMETIC_TTL", 10))
+
+# 已推送/已驳回的投稿超过这么多天后, 删除原始图片和 page.html, 只保留预览图
+COMPACT_AFTER_DAYS = int(os.getenv("COMPACT_AFTER_DAYS", 7))
+# 预览图归档格式 webp / jpeg, 留空表示保留 png
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "").lower()
+# jpg 即 jpeg, png 即保留原图
+ARCHIVE_FORMAT = {"jpg": "jpeg", "png": ""}.get(ARCHIVE_FORMAT, ARCHIVE_FORMAT)
+if ARCHIVE_FORMAT not in ("", "webp", "jpeg"):
+    raise ValueError(f"ARCHIVE_FORMAT 只能是 webp 或 jpeg, 而不是 {ARCHIVE_FORMAT}")
+ARCHIVE_QUALITY = int(os.getenv("ARCHIVE_QUALITY", 80))
+# data 目录的空间预算(MiB), 超出时删除最早的已结束投稿, 0 表示不限制
+DATA_BUDGET_MB = int(os.getenv("DATA_BUDGET_MB", 0))
+
+# 数据库读线程数, 写操作始终只在一个线程中执行
+DB_READERS = int(os.getenv("DB_READERS", 4))
+
+# QQ 空间客户端的缓存时间(秒)
+QZONE_CLIENT_TTL = float(os.getenv("QZONE_CLIENT_TTL", 3600))
+
+# 管理接口响应的缓存时间(秒)
+API_CACHE_TTL = float(os.getenv("API_CACHE_TTL", 5))
+
+# /image 允许生成的缩略图宽度
+IMAGE_WIDTHS = tuple(
+    int(w) for w in os.getenv("IMAGE_WIDTHS", "180,360,720").split(",") if w
+)
+
+# 小于这个大小(KiB)的图片直接以 base64 发送, 不用 NapCat 再回来请求 /image, 0 表示不使用
+INLINE_IMAGE_KB = int(os.getenv("INLINE_IMAGE_KB", 1024))
+
+# 为 1 时在启动后输出各模块的导入耗时和各初始化步骤的耗时
+PROFILE_STARTUP = os.getenv("PROFILE_STARTUP", "0") == "1"
+
+# 处理一条消息超过 TRACE_SLOW 秒记为慢操作, 可用 #性能 查看;
+# 超过 TRACE_ALERT 秒发到审核群提醒, 两次提醒至少间隔 TRACE_ALERT_COOLDOWN 秒, 0 表示不提醒
+TRACE_SLOW = float(os.getenv("TRACE_SLOW", 3))
+TRACE_ALERT = float(os.getenv("TRACE_ALERT", 30))
+TRACE_ALERT_COOLDOWN = float(os.getenv("TRACE_ALERT_COOLDOWN", 600))
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", 50))
@@ -1,22 +1,33 @@
 import asyncio
 import os
-import shutil
 import time
 from typing import Sequence
 
 
+from album import Album
+import blobs
 import config
-from models import Article, Session, Status
+from models import Article, Segment, Session, Status, db
 import image
+import lifecycle
+import metrics
+import notify
+from outbox import Outbox, Priority
+import render
+import repo
+import static
+import tracing
 import random
 import traceback
 import utils
 import agent
+import api
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from uvicorn import Config, Server
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from botx import Bot
 from botx.models import (
@@ -27,11 +38,19 @@ from botx.models import (
     FriendRequest,
     EmojiLike,
 )
-import httpx
+from peewee import fn
 
-bot = Bot(
-    ws_uri=config.WS_URL, token=config.ACCESS_TOKEN, log_level="DEBUG", msg_cd=0.5
+# 发送频率由 outbox 控制
+bot = Bot(ws_uri=config.WS_URL, token=config.ACCESS_TOKEN, log_level="DEBUG", msg_cd=0)
+
+# 记录每个处理函数和其中的调用耗时, 必须在注册处理函数之前
+tracer = tracing.Tracer(
+    slow=config.TRACE_SLOW,
+    alert=config.TRACE_ALERT,
+    cooldown=config.TRACE_ALERT_COOLDOWN,
+    size=config.TRACE_BUFFER,
 )
+tracer.instrument(bot)
 
 token = hex(random.randint(0, 2 << 128))[2:]
 
@@ -41,24 +60,100 @@ app = FastAPI()
 server = Server(Config(app=app, host="localhost", port=config.PORT, workers=1))
 
 
-def get_file_url(path: str):
-    return f"http://{config.HOST}:{config.PORT}/image?p={path}&t={token}"
+def get_file_url(path: str, width: int | None = None):
+    url = f"http://{config.HOST}:{config.PORT}/image?p={path}&t={token}&v={static.version(path)}"
+    return f"{url}&w={width}" if width else url
+
+
+def file_segments(paths: Sequence[str]) -> str:
+    # 小图直接内联, 大图让 NapCat 通过 /image 下载. 会读取文件, 只直接用于 help/ 等静态图片
+    return "".join(
+        f"[CQ:image,file={static.inline(path) or get_file_url(path)}]" for path in paths
+    )
+
+
+async def image_segments(paths: Sequence[str]) -> str:
+    # 预览图可能有上 MB, 在线程中读取和编码, 不阻塞事件循环
+    return await asyncio.to_thread(file_segments, list(paths))
 
 
 @app.get("/image")
-def get_image(p: str, t: str):
+def get_image(
+    request: Request, p: str, t: str, w: int | None = None, v: str | None = None
+):
     if t != token:
         raise HTTPException(status_code=401, detail="Nothing.")
-    return FileResponse(path=p)
+    return static.serve(request, p, w, v)
+
+
+def check_token(t: str):
+    if t != token:
+        raise HTTPException(status_code=401, detail="Nothing.")
+
+
+app.include_router(api.router, dependencies=[Depends(check_token)])
+
+
+@app.get("/metrics")
+def get_metrics(t: str):
+    if t != token:
+        raise HTTPException(status_code=401, detail="Nothing.")
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 sessions: dict[User, Session] = {}
 
+metrics.Gauge(
+    "nishikigi_sessions", "正在进行的投稿数", callback=lambda: {(): len(sessions)}
+)
+
+
+def queue_depth() -> dict[tuple, float]:
+    # /metrics 是同步路由, 在 FastAPI 的线程池中执行, 不经过 repo
+    depth = {(s.value,): 0 for s in Status}
+    with db.connection_context():
+        for article in Article.select(
+            Article.status, fn.COUNT(Article.id).alias("count")
+        ).group_by(Article.status):
+            depth[(article.status.value,)] = article.count
+    return depth
+
+
+metrics.Gauge(
+    "nishikigi_articles",
+    "各状态的投稿数",
+    labels=("status",),
+    callback=queue_depth,
+)
+
 start_time = time.time()
 
 # 管理的一些操作要上锁
 lock = asyncio.Lock()
 
+outbox = Outbox(
+    bot,
+    rate=config.OUTBOX_RATE,
+    rates={
+        Priority.INTERACTIVE: config.OUTBOX_INTERACTIVE_RATE,
+        Priority.ADMIN: config.OUTBOX_ADMIN_RATE,
+        Priority.BULK: config.NOTIFY_RATE,
+        Priority.COSMETIC: config.OUTBOX_COSMETIC_RATE,
+    },
+    cosmetic_ttl=config.OUTBOX_COSMETIC_TTL,
+)
+
+notifier = notify.Dispatcher(outbox, concurrency=config.NOTIFY_CONCURRENCY)
+
+album = Album(bot, config.ALBUM, ttl=config.QZONE_CLIENT_TTL)
+
+tracer.on_alert = lambda trace: outbox.post(
+    Priority.ADMIN,
+    lambda: bot.send_group(config.GROUP, f"⚠️ 处理过慢: {trace.summary()}"),
+)
+
 scheduler = AsyncIOScheduler()
 
 
@@ -67,19 +162,14 @@ async def error(context: dict, data: dict):
     exc = context.get("exception")
     tb = "".join(traceback.format_exception(exc)) if exc is not None else "no traceback"
     if "user_id" in data:
-        await bot.send_private(
+        await outbox.send_private(
             data["user_id"],
             f"出了一点小问题😵‍💫:\n\n{str(exc)}",
+            Priority.INTERACTIVE,
         )
-        await bot.send_group(
-            config.GROUP,
-            f"和用户 {data['user_id']} 对话时出错:\n{tb}",
-        )
+        await outbox.send_group(f"和用户 {data['user_id']} 对话时出错:\n{tb}")
     else:
-        await bot.send_group(
-            config.GROUP,
-            f"出错了:\n{tb}",
-        )
+        await outbox.send_group(f"出错了:\n{tb}")
 
 
 @bot.on_cmd(
@@ -92,7 +182,7 @@ async def error(context: dict, data: dict):
         " #投稿 匿名 :  隐藏投稿者身份\n"
         " #投稿 单发 匿名 :  匿名并单独发一条动态\n"
         "\n⚠️ 提示:  请正确输入命令, 不要多或少空格, 比如:  #投稿 匿名\n"
-        f"\n示例见图:  [CQ:image,url={get_file_url('help/article.jpg')}]"
+        f"\n示例见图:  {file_segments(['help/article.jpg'])}"
     ),
 )
 async def article(msg: PrivateMessage):
@@ -112,41 +202,42 @@ async def article(msg: PrivateMessage):
 
     # 如果命令不在允许列表中, 直接提示并返回
     if raw not in valid_options:
-        await msg.reply(
+        await outbox.reply(
+            msg,
             "❌ 投稿命令格式错误! \n"
             "正确格式示例:  \n"
             " #投稿\n"
             " #投稿 单发\n"
             " #投稿 匿名\n"
             " #投稿 单发 匿名\n"
-            "请勿在命令后直接添加内容"
+            "请勿在命令后直接添加内容",
         )
         return
 
     anonymous = "匿名" in raw
 
     if msg.sender in sessions:
-        await msg.reply("你还有投稿未结束🤔\n请先输入 #结束 来结束当前投稿")
+        await outbox.reply(msg, "你还有投稿未结束🤔\n请先输入 #结束 来结束当前投稿")
         return
 
     parts = raw.split(" ")
-    id = Article.create(
+    id = await repo.create_article(
         sender_id=msg.sender.user_id,
         sender_name=msg.sender.nickname,
         anonymous=anonymous,
         time=time.time(),
         single="单发" in parts,
-    ).id
+    )
 
     sessions[msg.sender] = Session(id=id, anonymous=anonymous)
-    if os.path.exists(f"./data/{id}"):
-        shutil.rmtree(f"./data/{id}")
+    blobs.remove_article(id)
     os.makedirs(f"./data/{id}", exist_ok=True)
 
     def status_words(value: bool) -> str:
         return "是" if value else "否"
 
-    await msg.reply(
+    await outbox.reply(
+        msg,
         f"✨ 开始投稿 😉\n"
         f"你发送的内容(除命令外)会计入投稿。\n"
         f"—— 投稿操作指南 ——\n"
@@ -154,99 +245,146 @@ async def article(msg: PrivateMessage):
         f"2️⃣ 取消投稿:  发送:  \n\n#取消\n\n来放弃本次投稿\n\n"
         f"匿名模式启用状态: {status_words(anonymous)}\n"
         f"单发模式启用状态: {status_words('单发' in parts)}\n"
-        f"⚠️ 匿名和单发在设定后无法更改, 如需更改请先取消本次投稿"
+        f"⚠️ 匿名和单发在设定后无法更改, 如需更改请先取消本次投稿",
     )
 
     if "单发" in parts:
-        await msg.reply(
-            "单发大概率被驳回! \n都单发的话, 大家的空间就会被挤满😵‍💫\n节约你我时间, 无需单发, 发送:  \n\n#取消\n\n后再重新投稿"
+        await outbox.reply(
+            msg,
+            "单发大概率被驳回! \n都单发的话, 大家的空间就会被挤满😵‍💫\n节约你我时间, 无需单发, 发送:  \n\n#取消\n\n后再重新投稿",
         )
     if anonymous:
-        await msg.reply(
-            "匿名投稿不显示你的昵称和头像\n若无需匿名,  发送:  \n\n#取消\n\n后再重新投稿\nPS: 之前有人匿名发失物招领"
+        await outbox.reply(
+            msg,
+            "匿名投稿不显示你的昵称和头像\n若无需匿名,  发送:  \n\n#取消\n\n后再重新投稿\nPS: 之前有人匿名发失物招领",
         )
 
     # await bot.send_group(config.GROUP, f"{msg.sender} 开始投稿")
 
 
+def prefetch(ses: Session, message_id: int, segments: tuple[Segment, ...]):
+    # 收到图片后立即在后台下载, #结束 时不用再等
+    async def download(s: Segment):
+        filepath = f"./data/{ses.id}/{s.value}"
+        if os.path.isfile(filepath):
+            return
+        if await blobs.store(s.value, s.url.replace("https://", "http://"), filepath):
+            bot.getLogger().info(f"下载图片: {filepath}")
+
+    async def run():
+        # 相同的图片只下载一次, 已经存过的直接链接过来
+        images = {s.value: s for s in segments if s.type == "image"}
+        await asyncio.gather(*map(download, images.values()))
+
+    def done(task: asyncio.Task):
+        # 没人等待的下载失败时也要记录下来, #结束 时会重新下载
+        if not task.cancelled() and task.exception() is not None:
+            bot.getLogger().warning(
+                f"下载投稿 #{ses.id} 的图片失败: {task.exception()!r}"
+            )
+
+    if any(s.type == "image" for s in segments):
+        task = asyncio.create_task(run())
+        task.add_done_callback(done)
+        ses.downloads[message_id] = task
+
+
 @bot.on_cmd("结束", help_msg="用于结束当前投稿")
 async def end(msg: PrivateMessage):
     if msg.sender not in sessions:
-        await msg.reply("你还没有投稿哦~")
+        await outbox.reply(msg, "你还没有投稿哦~")
         return
 
     bot.getLogger().debug(sessions[msg.sender].contents)
     if not sessions[msg.sender].contents:
-        await msg.reply(
-            "你好像啥都没有说呢😵‍💫\n不想投稿了请输入:  \n\n#取消\n\n或者说点什么再输入:  \n\n#结束"
+        await outbox.reply(
+            msg,
+            "你好像啥都没有说呢😵‍💫\n不想投稿了请输入:  \n\n#取消\n\n或者说点什么再输入:  \n\n#结束",
         )
         return
-    await msg.reply("正在生成预览图🚀\n请稍等片刻")
+    await outbox.reply(msg, "正在生成预览图🚀\n请稍等片刻")
     ses = sessions[msg.sender]
 
-    for content in ses.contents:
-        for m in content:
-            if m["type"] == "image":
-                filepath = f"./data/{ses.id}/{m['data']['file']}"
-                if not os.path.isfile(filepath):
-                    with httpx.stream(
-                        "GET",
-                        m["data"]["url"].replace("https://", "http://"),
-                        timeout=60,
-                    ) as resp:
-                        with open(filepath, mode="bw") as file:
-                            for chunk in resp.iter_bytes():
-                                file.write(chunk)
-                    bot.getLogger().info(f"下载图片: {filepath}")
+    # 图片在收到消息时就开始下载了, 这里只等待还没完成的, 失败的重新下载一次
+    for message_id, segments in ses.messages.items():
+        task = ses.downloads.get(message_id)
+        if task is None or (task.done() and (task.cancelled() or task.exception())):
+            prefetch(ses, message_id, segments)
+    # 等待期间消息可能被撤回, 对应的下载会被取消, 所以不能让取消传到这里
+    tasks = dict(ses.downloads)
+    with tracing.span("download"):
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    if sessions.get(msg.sender) is not ses:
+        return  # 等待期间投稿被取消了
+
+    failed = [
+        message_id
+        for message_id, result in zip(tasks, results)
+        if isinstance(result, Exception)
+        and not isinstance(result, asyncio.CancelledError)
+        and message_id in ses.messages
+    ]
+    # 下载失败的消息不放进预览, 内容以还没被撤回的消息为准
+    contents = [
+        segments
+        for message_id, segments in ses.messages.items()
+        if message_id not in failed
+    ]
+    if failed:
+        await outbox.reply(
+            msg,
+            f"有 {len(failed)} 条消息中的图片下载失败, 已从预览中去掉, 可以重新发送",
+        )
+    if not contents:
+        return
 
     vips = (await bot.call_api("get_group_member_list", {"group_id": config.GROUP}))[
         "data"
     ]
 
-    path = await image.generate_img(
+    paths = await image.generate_img(
         ses.id,
         user=msg.sender,
-        contents=ses.contents,
+        contents=contents,
         admin=any(map(lambda v: v["user_id"] == msg.sender.user_id, vips)),
         anonymous=ses.anonymous,
     )
 
-    await msg.reply(
-        f"[CQ:image,file={get_file_url(path)}]这样投稿可以吗😘\n可以的话请发送:  \n\n#确认\n\n不可以就发送:  \n\n#取消"
+    await outbox.reply(
+        msg,
+        f"{await image_segments(paths)}这样投稿可以吗😘\n可以的话请发送:  \n\n#确认\n\n不可以就发送:  \n\n#取消",
     )
 
 
 @bot.on_cmd("确认", help_msg="用于确认发送当前投稿")
 async def done(msg: PrivateMessage):
     if not msg.sender in sessions:
-        await msg.reply("你都还没投稿确认啥🤨")
+        await outbox.reply(msg, "你都还没投稿确认啥🤨")
         return
 
     session = sessions[msg.sender]
     if not os.path.isfile(f"./data/{session.id}/image.png"):
-        await msg.reply("请先发送:  \n\n#结束\n\n来查看效果图🤔")
+        await outbox.reply(msg, "请先发送:  \n\n#结束\n\n来查看效果图🤔")
         return
     sessions.pop(msg.sender)
-    article = Article.get_by_id(session.id)
+    session.cancel_downloads()
+    article = await repo.get_article(session.id)
     anon_text = "匿名" if article.anonymous else ""
     single_text = ", 要求单发" if article.single else ""
-    image_url = get_file_url(f"./data/{session.id}/image.png")
-    msg_id = await bot.send_group(
-        config.GROUP,
-        f"#{session.id} 用户 {msg.sender} {anon_text}投稿{single_text}\n[CQ:image,file={image_url}]\n* 若同意通过该投稿, 请点击下方表情, 满 1 人同意才会通过.\n  (注意: 取消贴表情不会取消通过的操作)\n* 若要驳回, 请使用 #驳回",
+    msg_id = await outbox.send_group(
+        f"#{session.id} 用户 {msg.sender} {anon_text}投稿{single_text}\n{await image_segments(image.get_images(session.id))}\n* 若同意通过该投稿, 请点击下方表情, 满 1 人同意才会通过.\n  (注意: 取消贴表情不会取消通过的操作)\n* 若要驳回, 请使用 #驳回",
     )
-    await bot.call_api("set_msg_emoji_like", {"message_id": msg_id, "emoji_id": 201})
-    Article.update({"status": Status.CONFRIMED, "tid": msg_id}).where(
-        Article.id == session.id,
-    ).execute()
-    await msg.reply("已成功投稿, 请耐心等待管理员审核😘")
+    await outbox.call_api("set_msg_emoji_like", {"message_id": msg_id, "emoji_id": 201})
+    await repo.update_article(session.id, {"status": Status.CONFRIMED, "tid": msg_id})
+    await outbox.reply(msg, "已成功投稿, 请耐心等待管理员审核😘")
 
-    await bot.call_api(
+    outbox.post_api(
         "set_diy_online_status",
         {
             "face_id": random.choice(config.STATUS_ID),
-            "wording": f"已接 {len(Article.select())} 单",
+            "wording": f"已接 {await repo.count_articles()} 单",
         },
+        key="set_diy_online_status",
     )
 
     await update_name()
@@ -255,28 +393,25 @@ async def done(msg: PrivateMessage):
 @bot.on_cmd("取消", help_msg="用于取消当前投稿")
 async def cancel(msg: PrivateMessage):
     if not msg.sender in sessions:
-        await msg.reply("你都还没投稿取消啥🤨")
+        await outbox.reply(msg, "你都还没投稿取消啥🤨")
         return
 
     id = sessions[msg.sender].id
-    Article.delete_by_id(id)
-    sessions.pop(msg.sender)
-    shutil.rmtree(f"./data/{id}")
-    await msg.reply("已取消本次投稿🫢")
+    await repo.delete_articles([id])
+    sessions.pop(msg.sender).cancel_downloads()
+    blobs.remove_article(id)
+    await outbox.reply(msg, "已取消本次投稿🫢")
 
     # await bot.send_group(config.GROUP, f"{msg.sender} 取消了投稿")
 
 
 @bot.on_cmd(
     "反馈",
-    help_msg=f"用于向管理员反馈你的问题😘\n使用方法:  输入 #反馈 后直接加上你要反馈的内容\n本账号无人值守, 不使用反馈发送的消息无法被看到\n使用案例:  [CQ:image,file={get_file_url('help/feedback.png')}]",
+    help_msg=f"用于向管理员反馈你的问题😘\n使用方法:  输入 #反馈 后直接加上你要反馈的内容\n本账号无人值守, 不使用反馈发送的消息无法被看到\n使用案例:  {file_segments(['help/feedback.png'])}",
 )
 async def feedback(msg: PrivateMessage):
-    await bot.send_group(
-        config.GROUP,
-        f"用户 {msg.sender} 反馈:\n{msg.raw_message}",
-    )
-    await msg.reply("感谢你的反馈😘")
+    await outbox.send_group(f"用户 {msg.sender} 反馈:\n{msg.raw_message}")
+    await outbox.reply(msg, "感谢你的反馈😘")
 
 
 @bot.on_msg()
@@ -284,12 +419,20 @@ async def content(msg: PrivateMessage):
     raw = msg.raw_message or ""
 
     async def agent_reply(msg):
-        await bot.call_api(
-            "set_input_status", {"user_id": msg.sender.user_id, "event_type": 1}
+        # 输入状态不影响回复, 还没发出的会被后一次覆盖
+        key = f"set_input_status:{msg.sender.user_id}"
+        outbox.post_api(
+            "set_input_status",
+            {"user_id": msg.sender.user_id, "event_type": 1},
+            key,
+            transient=True,
         )
         ai_result = await agent.ai_suggest_intent(raw)
-        await bot.call_api(
-            "set_input_status", {"user_id": msg.sender.user_id, "event_type": 2}
+        outbox.post_api(
+            "set_input_status",
+            {"user_id": msg.sender.user_id, "event_type": 2},
+            key,
+            transient=True,
         )
         await agent.reply_ai_suggestions(msg, ai_result)
 
@@ -304,19 +447,19 @@ async def content(msg: PrivateMessage):
         session = sessions[msg.sender]
         items = []
         for m in msg.message:
-            m["id"] = msg.message_id
             if m["type"] not in ["image", "text", "face"]:
-                await msg.reply(
-                    "当前版本仅支持文字、图片、表情～\n如需发送其他类型, 请用 #反馈 告诉我们\n请不要使用QQ的回复/引用功能, 该功能无法被机器人理解"
+                await outbox.reply(
+                    msg,
+                    "当前版本仅支持文字、图片、表情～\n如需发送其他类型, 请用 #反馈 告诉我们\n请不要使用QQ的回复/引用功能, 该功能无法被机器人理解",
                 )
-                await bot.send_group(
-                    config.GROUP,
-                    f"用户 {msg.sender} 发送了不支持的消息: {m.get('type')}",
+                await outbox.send_group(
+                    f"用户 {msg.sender} 发送了不支持的消息: {m.get('type')}"
                 )
                 continue
-            items.append(m)
+            items.append(Segment.from_onebot(m))
         if items:
-            session.contents.append(items)
+            session.add(msg.message_id, tuple(items))
+            prefetch(session, msg.message_id, session.messages[msg.message_id])
         return
     if agent.is_known_command(raw):
         return  # 已知命令由 @bot.on_cmd 处理, 不进入AI
@@ -328,7 +471,18 @@ async def recall(r: PrivateRecall):
     ses = sessions.get(User(nickname=None, user_id=r.user_id))  # type: ignore
     if not ses:
         return
-    ses.contents = [c for c in ses.contents if c[0]["id"] != r.message_id]
+    segments = ses.recall(r.message_id)
+    if not segments:
+        return
+    # 撤回的图片如果没有在其他消息中出现, 连同下载的文件一起删除
+    remaining = ses.images()
+    for s in segments:
+        if s.type != "image" or s.value in remaining:
+            continue
+        path = f"./data/{ses.id}/{s.value}"
+        if os.path.isfile(path):
+            os.remove(path)
+        blobs.release(s.value)
 
 
 # @bot.on_notice()
@@ -342,14 +496,14 @@ async def recall(r: PrivateRecall):
     targets=[config.GROUP],
 )
 async def approve(msg: GroupMessage):
-    async with lock:
-        parts = msg.raw_message.split(" ")
-        if len(parts) < 2:
-            await msg.reply("请带上要通过的投稿编号")
-            return
-        ids = parts[1:]
+    parts = msg.raw_message.split(" ")
+    if len(parts) < 2:
+        await outbox.reply(msg, "请带上要通过的投稿编号")
+        return
+    ids = parts[1:]
 
-        await approve_article(ids, operator=msg.sender.user_id)
+    # approve_article 自己上锁
+    await approve_article(ids, operator=msg.sender.user_id)
 
 
 @bot.on_cmd(
@@ -361,26 +515,24 @@ async def refuse(msg: GroupMessage):
     async with lock:
         parts = msg.raw_message.split(" ")
         if len(parts) < 3:
-            await msg.reply("请带上要驳回的投稿和理由")
+            await outbox.reply(msg, "请带上要驳回的投稿和理由")
             return
 
         id = parts[1]
         reason = parts[2:]
-        article = Article.get_or_none(
-            (Article.id == id) & (Article.status == Status.CONFRIMED)
-        )
+        article = await repo.get_article(id, Status.CONFRIMED)
         if article == None:
-            await msg.reply(f"投稿 #{id} 不存在或已通过审核")
+            await outbox.reply(msg, f"投稿 #{id} 不存在或已通过审核")
             return
 
-        Article.update(
-            {"status": Status.REJECTED, "approve": msg.sender.user_id}
-        ).where(Article.id == id).execute()
-        await bot.send_private(
+        await repo.update_article(
+            id, {"status": Status.REJECTED, "approve": msg.sender.user_id}
+        )
+        await outbox.send_private(
             article.sender_id,
             f"抱歉, 你的投稿 #{id} 已被管理员驳回😵‍💫 理由: {' '.join(reason)}",
         )
-        await msg.reply(f"已驳回投稿 #{id}")
+        await outbox.reply(msg, f"已驳回投稿 #{id}")
 
         await update_name()
 
@@ -391,24 +543,23 @@ async def refuse(msg: GroupMessage):
     targets=[config.GROUP],
 )
 async def push(msg: GroupMessage):
-    async with lock:
-        parts = msg.raw_message.split(" ")
-        if len(parts) < 2:
-            await msg.reply("请带上要通过的投稿id")
-            return
-
-        ids = parts[1:]
-        for id in ids:
-            article = Article.get_or_none(
-                (Article.id == id) & (Article.status == Status.QUEUE)
-            )
-            if not article:
-                await msg.reply(f"投稿 #{id} 不存在或已被推送或未通过审核")
+    # 通知在释放锁之后才发出, 不占用锁
+    async with notifier.batch() as batch:
+        async with lock:
+            parts = msg.raw_message.split(" ")
+            if len(parts) < 2:
+                await outbox.reply(msg, "请带上要通过的投稿id")
                 return
-        await msg.reply(f"开始推送 {ids}")
-        tid = await publish(ids)
-        await msg.reply(f"已推送 {ids}\ntid: {tid}")
-        await update_name()
+
+            ids = parts[1:]
+            for id, article in zip(ids, await repo.get_articles(ids, Status.QUEUE)):
+                if not article:
+                    await outbox.reply(msg, f"投稿 #{id} 不存在或已被推送或未通过审核")
+                    return
+            await outbox.reply(msg, f"开始推送 {ids}")
+            tid = await publish(ids, batch)
+            await outbox.reply(msg, f"已推送 {ids}\ntid: {tid}")
+    await update_name()
 
 
 @bot.on_cmd(
@@ -417,14 +568,13 @@ async def push(msg: GroupMessage):
 async def view(msg: GroupMessage):
     parts = msg.raw_message.split(" ")
     if len(parts) < 2:
-        await msg.reply("请带上要通过的投稿id")
+        await outbox.reply(msg, "请带上要通过的投稿id")
         return
 
     ids = parts[1:]
-    for id in ids:
-        article = Article.get_or_none(Article.id == id)
-        if not article or not os.path.exists(f"./data/{id}/image.png"):
-            await msg.reply(f"投稿 #{id} 不存在")
+    for id, article in zip(ids, await repo.get_articles(ids)):
+        if not article or not image.get_images(id):
+            await outbox.reply(msg, f"投稿 #{id} 不存在")
             return
 
         match article.status:
@@ -443,13 +593,11 @@ async def view(msg: GroupMessage):
 
         anon_text = "匿名" if article.anonymous else ""
         single_text = ", 要求单发" if article.single else ""
-        image_url = get_file_url(f"./data/{id}/image.png")
 
-        await bot.send_group(
-            group=config.GROUP,
-            msg=f"[CQ:reply,id={article.tid}]"
+        await outbox.send_group(
+            f"[CQ:reply,id={article.tid}]"
             + f"#{id} 用户 {article.sender_name}({article.sender_id}) {anon_text}投稿{single_text}\n"
-            + f"[CQ:image,file={image_url}]\n"
+            + f"{await image_segments(image.get_images(id))}\n"
             + f"状态: {status}\n"
             + (
                 ""
@@ -461,19 +609,34 @@ async def view(msg: GroupMessage):
 
 @bot.on_cmd("状态", help_msg="查看队列状态", targets=[config.GROUP])
 async def status(msg: GroupMessage):
-    confirmed = Article.select().where(Article.status == Status.CONFRIMED)
-    queue = Article.select().where(Article.status == Status.QUEUE)
-    await msg.reply(
-        f"Nishikigi 已运行 {int(time.time() - start_time)}s\n待审核: {utils.to_list(confirmed)}\n待推送: {utils.to_list(queue)}"
+    confirmed = await repo.list_by_status(Status.CONFRIMED)
+    queue = await repo.list_by_status(Status.QUEUE)
+    await outbox.reply(
+        msg,
+        f"Nishikigi 已运行 {int(time.time() - start_time)}s\n待审核: {utils.to_list(confirmed)}\n待推送: {utils.to_list(queue)}",
     )
 
 
+@bot.on_cmd("性能", help_msg="查看最近处理最慢的操作", targets=[config.GROUP])
+async def performance(msg: GroupMessage):
+    traces = tracer.slowest()
+    if not traces:
+        await outbox.reply(msg, f"最近没有超过 {config.TRACE_SLOW:g}s 的操作")
+        return
+    lines = [
+        f"{time.strftime('%H:%M:%S', time.localtime(t.started))} {t.summary()}"
+        for t in traces
+    ]
+    await outbox.reply(msg, "最近最慢的操作:\n" + "\n".join(lines))
+
+
 @bot.on_cmd("链接", help_msg="获取登录 QZone 的链接", targets=[config.GROUP])
 async def link(msg: GroupMessage):
     clientkey = (await bot.call_api("get_clientkey"))["data"]["clientkey"]
-    await msg.reply(
+    await outbox.reply(
+        msg,
         f"http://ssl.ptlogin2.qq.com/jump?ptlang=1033&clientuin={bot.me.user_id}&clientkey={clientkey}"
-        + f"&u1=https%3A%2F%2Fuser.qzone.qq.com%2F{bot.me.user_id}%2Finfocenter&keyindex=19"
+        + f"&u1=https%3A%2F%2Fuser.qzone.qq.com%2F{bot.me.user_id}%2Finfocenter&keyindex=19",
     )
 
 
@@ -485,59 +648,72 @@ async def link(msg: GroupMessage):
 async def reply(msg: GroupMessage):
     parts = msg.raw_message.split(" ")
     if len(parts) < 3:
-        await msg.reply("请带上你想回复的人和内容")
+        await outbox.reply(msg, "请带上你想回复的人和内容")
         return
     try:
         int(parts[1])
     except:
-        await msg.reply(f'"{parts[1]}" 不是一个有效的 QQ 号')
+        await outbox.reply(msg, f'"{parts[1]}" 不是一个有效的 QQ 号')
         return
 
-    resp = await bot.send_private(
-        int(parts[1]), f"😘管理员回复:\n{' '.join(parts[2:])}"
+    resp = await outbox.send_private(
+        int(parts[1]), f"😘管理员回复:\n{' '.join(parts[2:])}", Priority.INTERACTIVE
     )
     if resp is None:
-        await msg.reply(f"无法回复用户 {parts[1]}\n请检查 QQ 号是否正确")
+        await outbox.reply(msg, f"无法回复用户 {parts[1]}\n请检查 QQ 号是否正确")
     else:
-        await msg.reply(f"已回复用户 {parts[1]}")
+        await outbox.reply(msg, f"已回复用户 {parts[1]}")
 
 
 @bot.on_notice()
 async def emoji_approve(notice: EmojiLike):
     for emoji in notice.likes:
         if emoji.emoji_id == 201:
-            a = Article.select().where(Article.tid == notice.message_id)
+            a = await repo.find_by_tid(notice.message_id)
             if a:
-                await approve_article([a[0].id], operator=notice.user_id, is_emoji=True)
-
-
-async def publish(ids: Sequence[int | str]) -> list[str]:
-    qzone = await bot.get_qzone()
-    names = await qzone.upload_raw_image(
-        album_name=config.ALBUM,
-        file_path=list(map(lambda id: f"./data/{id}/image.png", ids)),
-    )
-
-    for i, id in enumerate(ids):
-        Article.update({"tid": names[i], "status": Status.PUBLISHED}).where(
-            Article.id == id
-        ).execute()
-        await bot.send_private(
-            Article.get_by_id(id).sender_id, f"您的投稿 #{id} 已被推送😋"
-        )
+                await approve_article([a.id], operator=notice.user_id, is_emoji=True)
+
+
+async def publish(
+    ids: Sequence[int | str], batch: notify.Batch | None = None
+) -> list[str]:
+    # 长投稿会被分成多张图片, 按顺序上传后再对应回各自的投稿
+    files = [image.get_images(id) for id in ids]
+    with metrics.qzone_upload_seconds.time(), tracing.span("qzone.upload"):
+        names = await album.upload([path for paths in files for path in paths])
+
+    offset = 0
+    updates = {}
+    for id, paths in zip(ids, files):
+        updates[int(id)] = {
+            "tid": ",".join(names[offset : offset + len(paths)]),
+            "status": Status.PUBLISHED,
+        }
+        offset += len(paths)
+    await repo.update_articles(updates)
+
+    # 没有传入 batch 时自己发送通知, 否则由调用者统一发送
+    own = batch is None
+    batch = batch or notifier.batch()
+    for article in await repo.get_articles(ids):
+        if article:
+            batch.send_private(article.sender_id, f"您的投稿 #{article.id} 已被推送😋")
+    if own:
+        await batch.flush()
     return names
 
 
 async def update_name():
-    confirmed = Article.select().where(Article.status == Status.CONFRIMED)
-    queue = Article.select().where(Article.status == Status.QUEUE)
-    await bot.call_api(
+    confirmed = await repo.list_by_status(Status.CONFRIMED)
+    queue = await repo.list_by_status(Status.QUEUE)
+    outbox.post_api(
         "set_group_card",
         {
             "group_id": config.GROUP,
             "user_id": bot.me.user_id,
             "card": f"待审核: {utils.to_list(confirmed)}\n待推送: {utils.to_list(queue)}",
         },
+        key="set_group_card",
     )
 
 
@@ -545,29 +721,49 @@ async def update_name():
 async def clear():
     async with lock:
         to_remove = []
-        for sess in list(sessions.keys()):
-            try:
-                a = Article.get_by_id(sessions[sess].id)
-            except Exception:
+        users = list(sessions.keys())
+        articles = await repo.get_articles([sessions[u].id for u in users])
+        for sess, a in zip(users, articles):
+            if a is None:
                 continue
             time_passed = time.time() - a.time.timestamp()
 
             if time_passed > 60 * 60:
                 to_remove.append(sess)
-                Article.delete_by_id(a.id)
-                if os.path.exists(f"./data/{a.id}"):
-                    shutil.rmtree(f"./data/{a.id}")
+                await repo.delete_articles([a.id])
+                blobs.remove_article(a.id)
 
-                await bot.send_private(
+                await outbox.send_private(
                     sess.user_id, f"您的投稿 {a} 因为超时而被自动取消."
                 )
-                await bot.send_group(
-                    config.GROUP, f"用户 {sess.user_id} 的投稿 {a} 因超时而被自动取消."
+                await outbox.send_group(
+                    f"用户 {sess.user_id} 的投稿 {a} 因超时而被自动取消."
                 )
                 bot.getLogger().warning(f"取消用户 {sess.user_id} 的投稿 {a}")
 
         for sess in to_remove:
-            sessions.pop(sess, None)
+            ses = sessions.pop(sess, None)
+            if ses:
+                ses.cancel_downloads()
+
+
+@scheduler.scheduled_job(CronTrigger(hour=4))
+async def compact_storage():
+    async with lock:
+        report = await asyncio.to_thread(lifecycle.run)
+    bot.getLogger().info(f"存储整理: {report}")
+    if report["compacted"] or report["evicted"]:
+        await outbox.send_group(
+            f"存储整理: 精简 {len(report['compacted'])} 条投稿, "
+            f"删除 {len(report['evicted'])} 条投稿, "
+            f"释放 {report['freed'] / 2**20:.1f} MiB, "
+            f"当前占用 {report['used'] / 2**20:.1f} MiB"
+        )
+
+
+@scheduler.scheduled_job(IntervalTrigger(minutes=1))
+async def check_render():
+    await render.pool.check()
 
 
 @bot.on_cmd(
@@ -577,38 +773,43 @@ async def delete(msg: GroupMessage):
     async with lock:
         parts = msg.raw_message.split(" ")
         if len(parts) < 2:
-            await msg.reply("请带上要删除的投稿id")
+            await outbox.reply(msg, "请带上要删除的投稿id")
             return
 
         ids = parts[1:]
-        for id in ids:
-            article = Article.get_or_none(
-                (Article.id == id) & (Article.status != Status.CREATED)
-            )
-            if not article:
-                await msg.reply(f"投稿 #{id} 不在队列中")
+        articles = await repo.get_articles(ids)
+        for id, article in zip(ids, articles):
+            if not article or article.status == Status.CREATED:
+                await outbox.reply(msg, f"投稿 #{id} 不在队列中")
                 return
-            Article.delete_by_id(id)
-            if os.path.exists(f"./data/{id}"):
-                shutil.rmtree(f"./data/{id}")
+        articles = list({a.id: a for a in articles if a}.values())
+        await repo.delete_articles([a.id for a in articles])
+
+        for article in articles:
+            id = article.id
+            blobs.remove_article(id)
 
             if article.status == Status.PUBLISHED:
-                qzone = await bot.get_qzone()
-                album = await qzone.get_album(config.ALBUM)
-                if album == None:
+                if await album.album_id() is None:
                     bot.getLogger().error(f"无法找到相册 {config.ALBUM}")
                     continue
-                image = await qzone.get_image(album_id=album, name=article.tid)
-                if image == None:
-                    await msg.reply(f"无法找到投稿 #{id} 对应的空间动态图片")
+                names = article.tid.split(",")
+                missing = await album.delete(names)
+                if len(missing) == len(names):
+                    # 与原来一致: 空间里一张都没删掉时不通知投稿人
+                    await outbox.reply(msg, f"无法找到投稿 #{id} 对应的空间动态图片")
                     continue
-                await qzone.delete_image(image)
+                if missing:
+                    await outbox.reply(
+                        msg,
+                        f"投稿 #{id} 有 {len(missing)} 张空间图片未找到: {', '.join(missing)}",
+                    )
 
-            await bot.send_private(
+            await outbox.send_private(
                 article.sender_id, f"你的投稿 #{id} 已被管理员删除😵‍💫"
             )
 
-    await msg.reply(f"已删除 {ids}")
+    await outbox.reply(msg, f"已删除 {ids}")
     await update_name()
 
 
@@ -618,16 +819,28 @@ async def friend_request(r: FriendRequest):
 
 
 async def approve_article(ids: list, operator: int, is_emoji: bool = False):
+    # 审核和推送在锁内完成, 批量通知在释放锁之后才发出
+    async with notifier.batch() as batch:
+        async with lock:
+            await _approve_article(ids, operator, is_emoji, batch)
+
+    await update_name()
+
+
+async def _approve_article(
+    ids: list, operator: int, is_emoji: bool, batch: notify.Batch
+):
     flag = False  # 只有有投稿加入队列时才判断是否推送
-    for id in ids:
-        article = Article.get_or_none(
-            (Article.id == id) & (Article.status == Status.CONFRIMED)
-        )
+    updates = {}
+    accepted = []
+    # 出错的行放在通过的行之后, 汇总消息中不会先说不存在再说进入队列
+    errors = []
+    for id, article in zip(ids, await repo.get_articles(ids, Status.CONFRIMED)):
         if not article:
-            if not is_emoji:
-                await bot.send_group(
-                    group=config.GROUP, msg=f"投稿 #{id} 不存在或已通过审核"
-                )
+            errors.append(f"投稿 #{id} 不存在或已通过审核")
+            continue
+        if article.id in updates:
+            errors.append(f"投稿 #{id} 重复")
             continue
 
         operators = article.approve.split(",") if article.approve else []
@@ -635,52 +848,45 @@ async def approve_article(ids: list, operator: int, is_emoji: bool = False):
             continue
         operators.append(str(operator))
 
-        Article.update({"approve": ",".join(operators)}).where(
-            Article.id == id
-        ).execute()
+        updates[article.id] = {"approve": ",".join(operators)}
 
         if len(operators) < 1:
             continue
 
-        await bot.send_group(config.GROUP, f"投稿 #{id} 进入待发送队列")
+        if not article.single:
+            updates[article.id]["status"] = Status.QUEUE
+        accepted.append(article)
+
+    # 审核人和状态在一个事务里一起写入
+    await repo.update_articles(updates)
+
+    for article in accepted:
+        id = article.id
+        batch.send_group(f"投稿 #{id} 进入待发送队列")
 
         if article.single:
-            await bot.send_group(group=config.GROUP, msg=f"开始推送 #{id}")
-            await publish([id])
-            await bot.send_group(group=config.GROUP, msg=f"投稿 #{id} 已经单发")
+            batch.send_group(f"开始推送 #{id}")
+            await publish([id], batch)
+            batch.send_group(f"投稿 #{id} 已经单发")
             continue
         else:
-            await bot.send_private(
+            batch.send_private(
                 article.sender_id,
                 f"您的投稿 {article} 已通过审核, 正在队列中等待发送",
             )
         flag = True
-        Article.update(
-            {
-                "status": Status.QUEUE,
-            }
-        ).where(Article.id == id).execute()
+
+    if not is_emoji:
+        for line in errors:
+            batch.send_group(line)
 
     if flag:
-        articles = (
-            Article.select()
-            .where(Article.status == Status.QUEUE)
-            .order_by(Article.id.asc())
-            .limit(config.QUEUE)
-        )
+        articles = await repo.list_by_status(Status.QUEUE, limit=config.QUEUE)
         if len(articles) < config.QUEUE:
-            await bot.send_group(
-                group=config.GROUP, msg=f"当前队列中有{len(articles)}个稿件, 暂不推送"
-            )
+            batch.send_group(f"当前队列中有{len(articles)}个稿件, 暂不推送")
         else:
-            await bot.send_group(
-                group=config.GROUP,
-                msg=f"队列已积压{len(articles)}个稿件, 将推送前{config.QUEUE}个稿件...",
+            batch.send_group(
+                f"队列已积压{len(articles)}个稿件, 将推送前{config.QUEUE}个稿件..."
             )
-            tid = await publish(list(map(lambda a: a.id, articles)))
-            await bot.send_group(
-                group=config.GROUP,
-                msg=f"已推送{list(map(lambda a: a.id, articles))}\ntid: {tid}",
-            )
-
-    await update_name()
+            tid = await publish(list(map(lambda a: a.id, articles)), batch)
+            batch.send_group(f"已推送{list(map(lambda a: a.id, articles))}\ntid: {tid}")
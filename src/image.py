@@ -1,28 +1,69 @@
 from datetime import datetime
 import os
+import time
+from typing import TYPE_CHECKING
 
 import config
+import metrics
+import render
+import tracing
 
-from botx.models import User
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-import playwright.async_api
+# 主进程只需要 generate_img, jinja2 和 playwright 在渲染进程中用到时再导入.
+# 渲染进程也不需要数据库
+if TYPE_CHECKING:
+    from botx.models import User
+    import playwright.async_api
+
+    from models import Segment
+
+# 以下对象只在渲染进程中创建
+env = None
+_playwright = None
+_browser = None
 
 
 async def generate_img(
-    id: int, user: User, anonymous: bool, contents: list, admin: bool = False
-) -> str:
-    env = Environment(
-        loader=FileSystemLoader("templates"),
-        trim_blocks=True,
-        lstrip_blocks=True,
-        autoescape=select_autoescape(
-            [
-                "html",
-            ]
-        ),
-    )
+    id: int,
+    user: "User",
+    anonymous: bool,
+    contents: list[tuple["Segment", ...]],
+    admin: bool = False,
+) -> list[str]:
+    with tracing.span("render"):
+        result = await render.pool.submit(
+            {
+                "id": id,
+                "user_id": user.user_id,
+                "nickname": user.nickname,
+                "anonymous": anonymous,
+                "contents": [[s.to_onebot() for s in items] for items in contents],
+                "admin": admin,
+            }
+        )
+    # 耗时在渲染进程中测量, 由主进程记录
+    for stage, seconds in result["timings"].items():
+        metrics.stage_seconds.observe(seconds, stage=stage)
+    return result["paths"]
+
+
+def render_page(job: dict):
+    global env
+    if env is None:
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+        env = Environment(
+            loader=FileSystemLoader("templates"),
+            trim_blocks=True,
+            lstrip_blocks=True,
+            autoescape=select_autoescape(
+                [
+                    "html",
+                ]
+            ),
+        )
+    id = job["id"]
     _contents = []
-    for items in contents:
+    for items in job["contents"]:
         values = [
             "__no_border__" if (len(items) == 1 and items[0]["type"] == "image") else ""
         ]
@@ -61,34 +102,135 @@ async def generate_img(
     output = env.get_template("normal.html").render(
         contents=_contents,
         date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        username=user.nickname,
-        user_id=user.user_id,
+        username=job["nickname"],
+        user_id=job["user_id"],
         # qrcode=os.path.abspath(f"./data/{id}/qrcode.png") if user else None,
-        admin=admin,
+        admin=job["admin"],
         id=id,
-        anonymous=anonymous,
+        anonymous=job["anonymous"],
     )
     with open(f"./data/{id}/page.html", mode="w") as f:
         f.write(output)
-    await screenshoot(id=id, output_path=f"./data/{id}/image.png")
-    return os.path.abspath(f"./data/{id}/image.png")
 
 
-async def screenshoot(id: int, output_path: str):
-    async with playwright.async_api.async_playwright() as p:
-        browser = await p.chromium.launch(headless=True, chromium_sandbox=True)
-        page = await browser.new_page(
-            viewport={"width": 720, "height": 720},
-            device_scale_factor=3,
+# 在渲染进程中执行, 见 render.py
+async def run_job(job: dict) -> dict:
+    id = job["id"]
+    start = time.perf_counter()
+    render_page(job)
+    rendered = time.perf_counter()
+    paths = await screenshoot(
+        id=id,
+        output_path=f"./data/{id}/image.png",
+        offline=job.get("offline", False),
+    )
+    return {
+        "paths": list(map(os.path.abspath, paths)),
+        "timings": {
+            "render": rendered - start,
+            "screenshot": time.perf_counter() - rendered,
+        },
+    }
+
+
+# 归档后的分段会被重新编码为其他格式, 见 lifecycle.py
+IMAGE_EXTS = ("png", "webp", "jpg")
+
+
+def tile_path(id: int, index: int, ext: str = "png") -> str:
+    # 第一张分段沿用 image.png, 未分段时与原来一致
+    name = "image" if index == 0 else f"image-{index}"
+    return f"./data/{id}/{name}.{ext}"
+
+
+def get_images(id: int | str) -> list[str]:
+    paths = []
+    while True:
+        for ext in IMAGE_EXTS:
+            path = tile_path(int(id), len(paths), ext)
+            if os.path.isfile(path):
+                paths.append(path)
+                break
+        else:
+            return paths
+
+
+async def get_browser() -> "playwright.async_api.Browser":
+    # 浏览器在渲染进程内复用, 不再每次截图都重新启动
+    global _playwright, _browser
+    if _browser is None or not _browser.is_connected():
+        if _playwright is None:
+            from playwright.async_api import async_playwright
+
+            _playwright = await async_playwright().start()
+        _browser = await _playwright.chromium.launch(
+            headless=True, chromium_sandbox=True
         )
+    return _browser
+
+
+async def warm() -> int:
+    await get_browser()
+    return os.getpid()
+
+
+async def close():
+    global _playwright, _browser
+    if _browser is not None:
+        await _browser.close()
+    if _playwright is not None:
+        await _playwright.stop()
+    _playwright = _browser = None
+
+
+async def screenshoot(id: int, output_path: str, offline: bool = False) -> list[str]:
+    browser = await get_browser()
+    page = await browser.new_page(
+        viewport={"width": 720, "height": 720},
+        device_scale_factor=3,
+    )
+    try:
+        if offline:
+            # 不加载头像等网络资源, 用于基准测试
+            await page.route("http*://**", lambda route: route.abort())
         await page.goto(
             f"file://{os.path.abspath(f"./data/{id}/page.html")}",
             wait_until="networkidle",
         )
-        await page.screenshot(
-            type="png",
-            full_page=True,
-            path=output_path,
-            animations="disabled",
+        width, height = await page.evaluate(
+            "[document.documentElement.scrollWidth, document.documentElement.scrollHeight]"
         )
-        await browser.close()
+
+        # 删除上一次预览留下的分段
+        for path in get_images(id)[1:]:
+            os.remove(path)
+
+        if config.TILE_HEIGHT <= 0 or height <= config.TILE_HEIGHT:
+            await page.screenshot(
+                type="png",
+                full_page=True,
+                path=output_path,
+                animations="disabled",
+            )
+            return [output_path]
+
+        # 按固定高度分段截图, 每次只需要一段的位图, 内存占用与投稿长度无关
+        paths = []
+        for y in range(0, height, config.TILE_HEIGHT):
+            path = output_path if not paths else tile_path(id, len(paths))
+            await page.screenshot(
+                type="png",
+                full_page=True,
+                clip={
+                    "x": 0,
+                    "y": y,
+                    "width": width,
+                    "height": min(config.TILE_HEIGHT, height - y),
+                },
+                path=path,
+                animations="disabled",
+            )
+            paths.append(path)
+        return paths
+    finally:
+        await page.close()
@@ -0,0 +1,150 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+import blobs
+import config
+import image
+from models import Article, Status
+import static
+
+logger = logging.getLogger("lifecycle")
+
+# 已推送和已驳回的投稿不会再生成预览, 只需要保留最终的图片
+FINISHED = (Status.PUBLISHED, Status.REJECTED)
+
+
+def usage(path: str = "./data") -> int:
+    # 按 inode 去重, 硬链接到 blobs 的图片只算一次
+    seen = set()
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_blocks * 512
+    return total
+
+
+def releasable(dir: str) -> int:
+    # 删除投稿目录后真正能释放的空间. 只被本目录引用的文件, 或者另一个链接
+    # 就是 blobs 中那一份(会随之释放)的图片才算, 与其他投稿共用的图片不算
+    total = 0
+    for name in os.listdir(dir):
+        try:
+            st = os.stat(os.path.join(dir, name))
+        except FileNotFoundError:
+            continue
+        if st.st_nlink == 2:
+            try:
+                blob = os.stat(blobs.blob_path(name))
+            except FileNotFoundError:
+                continue
+            if (blob.st_dev, blob.st_ino) != (st.st_dev, st.st_ino):
+                continue
+        elif st.st_nlink != 1:
+            continue
+        total += st.st_blocks * 512
+    return total
+
+
+def archive(path: str) -> str:
+    from PIL import Image
+
+    ext = "jpg" if config.ARCHIVE_FORMAT == "jpeg" else config.ARCHIVE_FORMAT
+    target = f"{os.path.splitext(path)[0]}.{ext}"
+    if target == path:
+        return path
+    try:
+        with Image.open(path) as img:
+            if config.ARCHIVE_FORMAT == "jpeg":
+                img = img.convert("RGB")
+            img.save(
+                target, format=config.ARCHIVE_FORMAT, quality=config.ARCHIVE_QUALITY
+            )
+    except Exception:
+        # 不留下写了一半的文件, 原图保持不变
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+    os.remove(path)
+    return target
+
+
+def compact(article: Article) -> bool:
+    dir = f"./data/{article.id}"
+    if not os.path.isdir(dir):
+        return False
+    tiles = image.get_images(article.id)
+    keep = {os.path.basename(p) for p in tiles}
+    changed = False
+
+    # 删除原始图片和 page.html
+    for name in os.listdir(dir):
+        if name not in keep:
+            os.remove(os.path.join(dir, name))
+            blobs.release(name)
+            changed = True
+
+    if config.ARCHIVE_FORMAT:
+        for path in tiles:
+            if not path.endswith(".png"):
+                continue
+            try:
+                archive(path)
+                changed = True
+            except Exception as e:
+                logger.warning(f"归档 {path} 失败: {e!r}")
+    return changed
+
+
+def evict(budget: int) -> list[int]:
+    # 超出空间预算时, 从最早的已结束投稿开始整个删除
+    evicted = []
+    used = usage()
+    if used <= budget:
+        return evicted
+    for article in (
+        Article.select(Article.id)
+        .where(Article.status.in_(FINISHED))
+        .order_by(Article.id.asc())
+    ):
+        dir = f"./data/{article.id}"
+        if not os.path.isdir(dir):
+            continue
+        freed = releasable(dir)
+        blobs.remove_article(article.id)
+        evicted.append(article.id)
+        used -= freed
+        if used <= budget:
+            break
+    return evicted
+
+
+def run() -> dict:
+    before = usage()
+    cutoff = datetime.now() - timedelta(days=config.COMPACT_AFTER_DAYS)
+    compacted = []
+    for article in Article.select().where(
+        Article.status.in_(FINISHED) & (Article.time < cutoff)
+    ):
+        # 一条投稿出错不影响其他投稿
+        try:
+            if compact(article):
+                compacted.append(article.id)
+        except Exception as e:
+            logger.warning(f"整理投稿 #{article.id} 失败: {e!r}")
+    evicted = evict(config.DATA_BUDGET_MB * 2**20) if config.DATA_BUDGET_MB else []
+    blobs.gc()
+    static.prune(cutoff.timestamp())
+    after = usage()
+    return {
+        "compacted": compacted,
+        "evicted": evicted,
+        "freed": before - after,
+        "used": after,
+    }
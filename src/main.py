@@ -1,18 +1,73 @@
 import asyncio
 import os
 
-import core
 
-if os.geteuid() == 0:
-    print("请不要使用 root 用户运行此程序.")
-    exit(-1)
+async def wait_connected(bot, timeout: float = 30) -> bool:
+    # 连接成功并取到登录信息后 bot.me 才可用
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        try:
+            if bot.me:
+                return True
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+    return False
 
-os.makedirs("./data", exist_ok=True)
+
+async def warm_up(core, render, agent, profiling):
+    # 先让 Bot 连上并开始回复, 再在后台启动渲染进程和 LLM 客户端.
+    # 在此之前到达的渲染任务会自行启动渲染进程
+    if await wait_connected(core.bot):
+        profiling.mark("connected")
+    with profiling.step("render.pool.warm"):
+        await render.pool.warm()
+    with profiling.step("agent.get_client"):
+        agent.get_client()
+    profiling.mark("ready")
+    if profiling.steps:
+        core.bot.getLogger().info(profiling.report())
+    profiling.disable()
 
 
 async def main():
-    core.scheduler.start()
-    await asyncio.gather(core.bot.start(), core.server.serve())
+    # 渲染进程以 spawn 方式启动, 会重新导入本文件, 因此 core 只在这里导入
+    import config
+    import profiling
+
+    if config.PROFILE_STARTUP:
+        profiling.enable()
+
+    with profiling.step("import core"):
+        import core
+    import agent
+    import metrics
+    import models
+    import render
+    import repo
+
+    with profiling.step("models.init"):
+        models.init()
+    with profiling.step("scheduler.start"):
+        core.scheduler.start()
+    lag = asyncio.create_task(metrics.watch_loop_lag())
+    warm = asyncio.create_task(warm_up(core, render, agent, profiling))
+    try:
+        await asyncio.gather(core.bot.start(), core.server.serve())
+    finally:
+        warm.cancel()
+        lag.cancel()
+        await render.pool.stop()
+        await agent.close()
+        repo.shutdown()
+
+
+if __name__ == "__main__":
+    if os.geteuid() == 0:
+        print("请不要使用 root 用户运行此程序.")
+        exit(-1)
 
+    os.makedirs("./data", exist_ok=True)
 
-asyncio.run(main())
+    asyncio.run(main())
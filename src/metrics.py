@@ -0,0 +1,172 @@
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+# 简单的 Prometheus 文本格式指标, 只在本进程内统计
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+registry: list["Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def collect(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_labels(self.labels, k)} {_number(v)}"
+            for k, v in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    # callback 在抓取时调用, 返回 {标签值元组: 数值}
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        callback: Callable[[], dict[tuple, float]] | None = None,
+    ):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def samples(self) -> list[str]:
+        values = self.callback() if self.callback else self.values
+        return [
+            f"{self.name}{_labels(self.labels, k)} {_number(v)}"
+            for k, v in values.items()
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = (*sorted(buckets), math.inf)
+        # 标签值 -> [各桶计数, 总和, 总数]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts, _, _ = entry = self.values[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _labels(self.labels, key, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for m in registry for line in m.collect()) + "\n"
+
+
+stage_seconds = Histogram(
+    "nishikigi_preview_stage_seconds",
+    "#结束 生成预览各阶段耗时",
+    labels=("stage",),
+)
+llm_seconds = Histogram("nishikigi_llm_seconds", "大模型调用耗时")
+llm_errors = Counter("nishikigi_llm_errors_total", "大模型调用失败次数")
+qzone_upload_seconds = Histogram(
+    "nishikigi_qzone_upload_seconds", "推送时上传 QQ 空间的耗时"
+)
+loop_lag_seconds = Histogram(
+    "nishikigi_event_loop_lag_seconds",
+    "事件循环延迟",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+
+async def watch_loop_lag(interval: float = 1.0):
+    # 定时 sleep, 实际醒来比预期晚的部分就是事件循环被阻塞的时间
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(time.perf_counter() - start - interval, 0.0))
@@ -1,3 +1,6 @@
+import asyncio
+import hashlib
+import json
 from dataclasses import dataclass, field
 from enum import Enum
 from peewee import (
@@ -11,7 +14,8 @@ from peewee import (
     Field,
 )
 
-db = SqliteDatabase("data.db")
+# WAL 模式下读写互不阻塞, 写线程忙时其他连接最多等待 busy_timeout 毫秒
+db = SqliteDatabase("data.db", pragmas={"journal_mode": "wal", "busy_timeout": 5000})
 
 
 class EnumField(Field):
@@ -60,11 +64,120 @@ class Article(Model):
         return f"#{self.id}"
 
 
-Article.create_table(safe=True)
+def init():
+    # 建表放在启动时执行, 导入 models 不会访问数据库
+    db.create_tables([Article], safe=True)
+
+
+class Segment:
+    # 投稿中的一段内容. text 的 value 是文字, face 是表情 ID, image 是 OneBot 的 file 名
+    __slots__ = ("type", "value", "sub_type", "url")
+
+    type: str
+    value: str
+    sub_type: int
+    url: str
+
+    def __init__(self, type: str, value: str, sub_type: int = 0, url: str = ""):
+        self.type = type
+        self.value = value
+        self.sub_type = sub_type
+        self.url = url
+
+    def __repr__(self):
+        return f"Segment({self.type!r}, {self.value!r})"
+
+    @classmethod
+    def from_onebot(cls, m: dict) -> "Segment":
+        data = m["data"]
+        match m["type"]:
+            case "text":
+                return cls("text", data["text"])
+            case "face":
+                return cls("face", str(data["id"]))
+            case "image":
+                return cls(
+                    "image",
+                    data["file"],
+                    int(data.get("sub_type") or 0),
+                    data.get("url") or "",
+                )
+        raise ValueError(f"不支持的消息类型: {m['type']}")
+
+    def to_onebot(self) -> dict:
+        match self.type:
+            case "text":
+                return {"type": "text", "data": {"text": self.value}}
+            case "face":
+                return {"type": "face", "data": {"id": self.value}}
+            case _:
+                return {
+                    "type": "image",
+                    "data": {"file": self.value, "sub_type": self.sub_type},
+                }
+
+    def to_tuple(self) -> tuple:
+        return (self.type, self.value, self.sub_type, self.url)
 
 
 @dataclass(slots=True)
 class Session:
     id: int
     anonymous: bool
-    contents: list = field(default_factory=list)
+    # message_id -> 该消息的内容. dict 保持发送顺序, 同时是撤回时用的索引
+    messages: dict[int, tuple[Segment, ...]] = field(default_factory=dict)
+    # message_id -> 下载该消息中图片的任务
+    downloads: dict[int, asyncio.Task] = field(default_factory=dict)
+
+    @property
+    def contents(self) -> list[tuple[Segment, ...]]:
+        return list(self.messages.values())
+
+    def add(self, message_id: int, segments: tuple[Segment, ...]):
+        self.messages[message_id] = segments
+
+    def recall(self, message_id: int) -> tuple[Segment, ...] | None:
+        task = self.downloads.pop(message_id, None)
+        if task is not None:
+            task.cancel()
+        return self.messages.pop(message_id, None)
+
+    def cancel_downloads(self):
+        for task in self.downloads.values():
+            task.cancel()
+        self.downloads.clear()
+
+    def images(self) -> set[str]:
+        return {
+            s.value for segments in self.contents for s in segments if s.type == "image"
+        }
+
+    # 序列化为紧凑的 JSON, 用于持久化; digest 用于判断内容是否变化
+    def dump(self) -> bytes:
+        return json.dumps(
+            [
+                self.id,
+                self.anonymous,
+                [
+                    [id, [s.to_tuple() for s in segs]]
+                    for id, segs in self.messages.items()
+                ],
+            ],
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+
+    @classmethod
+    def load(cls, data: bytes) -> "Session":
+        id, anonymous, messages = json.loads(data)
+        return cls(
+            id=id,
+            anonymous=anonymous,
+            messages={
+                message_id: tuple(Segment(*s) for s in segs)
+                for message_id, segs in messages
+            },
+        )
+
+    def digest(self) -> str:
+        return hashlib.sha256(self.dump()).hexdigest()
@@ -0,0 +1,63 @@
+import asyncio
+
+from outbox import Outbox, Priority
+
+
+class Batch:
+    # 收集一次操作中要发出的通知, 私聊并发发送, 群内状态合并成一条消息
+    def __init__(self, dispatcher: "Dispatcher"):
+        self.dispatcher = dispatcher
+        self.private: list[tuple[int, str]] = []
+        self.lines: list[str] = []
+
+    def send_private(self, user_id: int, msg: str):
+        self.private.append((user_id, msg))
+
+    def send_group(self, line: str):
+        self.lines.append(line)
+
+    async def flush(self) -> list[tuple[int, str]]:
+        private, lines = self.private, self.lines
+        self.private, self.lines = [], []
+
+        failures = await self.dispatcher.send_private_many(private)
+        for user_id, _ in failures:
+            lines.append(f"无法通知用户 {user_id}")
+        if lines:
+            await self.dispatcher.outbox.send_group("\n".join(lines))
+        return failures
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        # 出错时也把已经产生的通知发出去
+        await self.flush()
+
+
+class Dispatcher:
+    # 频率由 outbox 中 BULK 类的限制控制, semaphore 只限制同时在途的请求数,
+    # 不会超过频率限制, 见 config.NOTIFY_RATE
+    def __init__(self, outbox: Outbox, concurrency: int):
+        self.outbox = outbox
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def send_private(self, user_id: int, msg: str) -> bool:
+        async with self.semaphore:
+            try:
+                resp = await self.outbox.send_private(user_id, msg, Priority.BULK)
+                return resp is not None
+            except Exception as e:
+                self.outbox.bot.getLogger().warning(f"通知用户 {user_id} 失败: {e}")
+                return False
+
+    async def send_private_many(
+        self, messages: list[tuple[int, str]]
+    ) -> list[tuple[int, str]]:
+        results = await asyncio.gather(
+            *(self.send_private(user_id, msg) for user_id, msg in messages)
+        )
+        return [m for m, ok in zip(messages, results) if not ok]
+
+    def batch(self) -> Batch:
+        return Batch(self)
@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable
+
+from botx import Bot
+from botx.models import GroupMessage
+
+import config
+import tracing
+from utils import RateLimiter
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # 回复正在操作的用户
+    ADMIN = 1  # 审核群里的反馈和日志
+    BULK = 2  # 批量通知
+    COSMETIC = 3  # 输入状态、群名片、在线状态等
+
+
+@dataclass(slots=True)
+class Item:
+    priority: Priority
+    factory: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    key: str | None = None
+    # 只在当下有意义的调用(如输入状态), 排队太久就丢弃
+    transient: bool = False
+    created: float = field(default_factory=time.monotonic)
+    # 提交时的上下文, 执行时沿用, 调用会记在提交者的 trace 里
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+# 所有发出的消息和调用都在这里排队, 按优先级和各自的频率限制依次放行
+class Outbox:
+    def __init__(
+        self,
+        bot: Bot,
+        rate: float,
+        rates: dict[Priority, float],
+        cosmetic_ttl: float,
+    ):
+        self.bot = bot
+        self.limiter = RateLimiter(rate)
+        self.limiters = {p: RateLimiter(rates.get(p, 0)) for p in Priority}
+        self.cosmetic_ttl = cosmetic_ttl
+        self._queues: dict[Priority, deque[Item]] = {p: deque() for p in Priority}
+        # 还在排队的可合并调用, key -> 排队中的项
+        self._pending: dict[str, Item] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    def submit(
+        self,
+        priority: Priority,
+        factory: Callable[[], Awaitable[Any]],
+        key: str | None = None,
+        transient: bool = False,
+    ) -> asyncio.Future:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        if key is not None and key in self._pending:
+            # 同一对象的调用还没发出, 只保留最新的一次
+            item = self._pending[key]
+            item.factory = factory
+            item.created = time.monotonic()
+            return item.future
+
+        item = Item(
+            priority,
+            factory,
+            asyncio.get_running_loop().create_future(),
+            key,
+            transient,
+        )
+        if key is not None:
+            self._pending[key] = item
+        self._queues[priority].append(item)
+        self._wakeup.set()
+        return item.future
+
+    def post(
+        self,
+        priority: Priority,
+        factory: Callable[[], Awaitable[Any]],
+        key: str | None = None,
+        transient: bool = False,
+    ):
+        # 不等待结果, 失败只记录日志
+        def done(future: asyncio.Future):
+            if not future.cancelled() and future.exception() is not None:
+                self.bot.getLogger().warning(f"调用失败: {future.exception()}")
+
+        self.submit(priority, factory, key, transient).add_done_callback(done)
+
+    async def reply(self, msg, text: str, priority: Priority | None = None):
+        # 审核群里的命令回复算作管理反馈
+        if priority is None:
+            if isinstance(msg, GroupMessage):
+                priority = Priority.ADMIN
+            else:
+                priority = Priority.INTERACTIVE
+        return await self.submit(priority, lambda: msg.reply(text))
+
+    async def send_private(
+        self, user_id: int, msg: str, priority: Priority = Priority.BULK
+    ):
+        return await self.submit(priority, lambda: self.bot.send_private(user_id, msg))
+
+    async def send_group(
+        self, msg: str, priority: Priority = Priority.ADMIN, group: int = config.GROUP
+    ):
+        return await self.submit(priority, lambda: self.bot.send_group(group, msg))
+
+    async def call_api(
+        self, action: str, params: dict | None = None, priority=Priority.ADMIN
+    ):
+        return await self.submit(priority, lambda: self.bot.call_api(action, params))
+
+    def post_api(
+        self,
+        action: str,
+        params: dict,
+        key: str | None = None,
+        transient: bool = False,
+    ):
+        # 设置状态的调用(群名片等)即使排队很久也要发出最新的值, 否则会一直停在旧状态
+        self.post(
+            Priority.COSMETIC,
+            lambda: self.bot.call_api(action, params),
+            key=key,
+            transient=transient,
+        )
+
+    def _expired(self, item: Item, now: float) -> bool:
+        return item.transient and now - item.created > self.cosmetic_ttl
+
+    def _pop(self) -> tuple[Item | None, float | None]:
+        now = time.monotonic()
+        delay = None
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and self._expired(queue[0], now):
+                # 过时的输入状态等调用直接丢弃
+                self._finish(queue.popleft(), None)
+            if not queue:
+                continue
+            wait = max(self.limiter.delay(), self.limiters[priority].delay())
+            if wait <= 0:
+                self.limiter.reserve()
+                self.limiters[priority].reserve()
+                item = queue.popleft()
+                if item.key is not None:
+                    self._pending.pop(item.key, None)
+                return item, None
+            # 高优先级被限流时, 低优先级可以先走
+            delay = wait if delay is None else min(delay, wait)
+        return None, delay
+
+    def _finish(self, item: Item, result: Any):
+        if item.key is not None and self._pending.get(item.key) is item:
+            self._pending.pop(item.key)
+        if not item.future.done():
+            item.future.set_result(result)
+
+    async def _execute(self, item: Item):
+        tracing.record(f"排队 {item.priority.name}", time.monotonic() - item.created)
+        try:
+            result = await item.factory()
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            self._finish(item, result)
+
+    async def _run(self):
+        while True:
+            item, delay = self._pop()
+            if item is not None:
+                task = asyncio.create_task(self._execute(item), context=item.context)
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
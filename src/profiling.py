@@ -0,0 +1,97 @@
+import sys
+import time
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+
+# 启动耗时分析, PROFILE_STARTUP=1 时启用. 记录每个模块导入的耗时和各初始化步骤的耗时
+
+# 模块名 -> (总耗时, 自身耗时), 自身耗时不含其中再导入的模块
+imports: dict[str, tuple[float, float]] = {}
+# (步骤, 耗时)
+steps: list[tuple[str, float]] = []
+
+_stack: list[float] = []
+_enabled = False
+_start = time.perf_counter()
+
+
+class _Loader:
+    # 包装真正的 loader, 只在执行模块代码时计时
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        _stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            children = _stack.pop()
+            if _stack:
+                _stack[-1] += total
+            imports[self._name] = (total, total - children)
+
+
+class _Finder(MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _Loader(spec.loader, fullname)
+            return spec
+        return None
+
+
+def enable():
+    global _enabled, _start
+    if not _enabled:
+        _enabled = True
+        _start = time.perf_counter()
+        sys.meta_path.insert(0, _Finder())
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    sys.meta_path[:] = [f for f in sys.meta_path if not isinstance(f, _Finder)]
+
+
+@contextmanager
+def step(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _enabled:
+            steps.append((name, time.perf_counter() - start))
+
+
+def mark(name: str):
+    # 记录从启用到现在经过的时间, 如连接成功
+    if _enabled:
+        steps.append((name, time.perf_counter() - _start))
+
+
+def report(top: int = 25) -> str:
+    lines = ["启动耗时分析", f"{'step':<32}{'ms':>10}"]
+    lines += [f"{name:<32}{seconds * 1000:>10.1f}" for name, seconds in steps]
+    lines += ["", f"{'module':<32}{'self(ms)':>10}{'total(ms)':>10}"]
+    slowest = sorted(imports.items(), key=lambda i: i[1][1], reverse=True)[:top]
+    lines += [
+        f"{name:<32}{own * 1000:>10.1f}{total * 1000:>10.1f}"
+        for name, (total, own) in slowest
+    ]
+    lines.append(f"共导入 {len(imports)} 个模块")
+    return "\n".join(lines)
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import traceback
+
+import config
+
+logger = logging.getLogger("render")
+
+
+class RenderError(Exception):
+    pass
+
+
+def _worker_main(conn):
+    # 由主进程负责退出, 忽略终端的 Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import image
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    while True:
+        try:
+            op, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            match op:
+                case "ping":
+                    result = os.getpid()
+                case "warm":
+                    result = loop.run_until_complete(image.warm())
+                case "render":
+                    result = loop.run_until_complete(image.run_job(payload))
+                case _:
+                    raise ValueError(f"未知的任务类型: {op}")
+            conn.send((True, result))
+        except Exception as e:
+            conn.send((False, "".join(traceback.format_exception(e))))
+    loop.run_until_complete(image.close())
+    loop.close()
+
+
+# 一个渲染进程. 通过 Pipe 收发 (op, payload) -> (ok, result), 同一时间只处理一个任务
+class Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.pending = 0
+        self.lock = asyncio.Lock()
+        self.process = None
+        self.conn = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def start(self):
+        # fork 会复制主进程的事件循环和连接, 所以用 spawn
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child,),
+            name=f"render-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+    async def stop(self, graceful: bool = True):
+        process, conn = self.process, self.conn
+        self.process = self.conn = None
+        if process is None or conn is None:
+            return
+        if graceful:
+            # 关闭管道后进程会自行关闭浏览器并退出
+            conn.close()
+            await asyncio.to_thread(process.join, 5)
+        if process.is_alive():
+            process.kill()
+            await asyncio.to_thread(process.join, 5)
+        conn.close()
+
+    async def restart(self):
+        await self.stop(graceful=False)
+        self.start()
+
+    async def call(self, op: str, payload=None, timeout: float | None = None):
+        self.pending += 1
+        try:
+            async with self.lock:
+                if not self.alive:
+                    await self.restart()
+                assert self.conn is not None
+                try:
+                    self.conn.send((op, payload))
+                    ok, result = await asyncio.wait_for(
+                        asyncio.to_thread(self.conn.recv), timeout
+                    )
+                except (asyncio.TimeoutError, EOFError, OSError) as e:
+                    await self.restart()
+                    raise RenderError(f"渲染进程 {self.index} 无响应: {e!r}") from e
+                except asyncio.CancelledError:
+                    # 之后的结果会和请求错位, 直接丢弃这个进程, 下次调用时重启.
+                    # 清空 process 使 alive 为 False, 不会再往断开的管道里写
+                    process, conn = self.process, self.conn
+                    self.process = self.conn = None
+                    if process is not None:
+                        process.kill()
+                    if conn is not None:
+                        conn.close()
+                    raise
+                if not ok:
+                    raise RenderError(result)
+                return result
+        finally:
+            self.pending -= 1
+
+
+class RenderPool:
+    def __init__(self, size: int):
+        self.workers = [Worker(i) for i in range(max(size, 1))]
+
+    def start(self):
+        for worker in self.workers:
+            if not worker.alive:
+                worker.start()
+
+    async def stop(self):
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+
+    def _pick(self, tried: set[int]) -> Worker:
+        # 优先选择没试过的进程, 其中排队任务最少的
+        candidates = [w for w in self.workers if w.index not in tried] or self.workers
+        return min(candidates, key=lambda w: w.pending)
+
+    async def submit(self, job: dict):
+        tried = set()
+        error = RenderError("没有可用的渲染进程")
+        for _ in range(config.RENDER_RETRY + 1):
+            worker = self._pick(tried)
+            tried.add(worker.index)
+            try:
+                return await worker.call("render", job, timeout=config.RENDER_TIMEOUT)
+            except RenderError as e:
+                error = e
+                logger.warning(f"渲染进程 {worker.index} 渲染 #{job['id']} 失败: {e}")
+        raise error
+
+    async def warm(self):
+        # 提前启动进程和浏览器, 第一次渲染就不用等待
+        self.start()
+
+        async def warm(worker: Worker):
+            try:
+                await worker.call("warm", timeout=config.RENDER_TIMEOUT)
+            except RenderError as e:
+                logger.warning(f"渲染进程 {worker.index} 预热失败: {e}")
+
+        await asyncio.gather(*(warm(w) for w in self.workers))
+
+    async def check(self):
+        async def ping(worker: Worker):
+            # 正在渲染的进程不打扰, 超时会在 call 中处理
+            if worker.pending:
+                return
+            try:
+                await worker.call("ping", timeout=10)
+            except RenderError as e:
+                logger.warning(f"渲染进程 {worker.index} 健康检查失败, 已重启: {e}")
+
+        await asyncio.gather(*(ping(w) for w in self.workers))
+
+
+pool = RenderPool(config.RENDER_WORKERS)
@@ -0,0 +1,124 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Sequence
+
+import config
+from models import Article, Status, db
+import tracing
+
+# peewee 是同步的, 查询都放到线程里执行, 不阻塞事件循环.
+# SQLite 同一时间只允许一个写入者, 所以写操作排在同一个线程里, 读操作用线程池并发
+_writer = ThreadPoolExecutor(1, thread_name_prefix="db-writer")
+_readers = ThreadPoolExecutor(max(config.DB_READERS, 1), thread_name_prefix="db-reader")
+
+
+def _run_in(executor: ThreadPoolExecutor):
+    def decorator(func):
+        def call(*args, **kwargs):
+            # 每个线程保留自己的连接
+            db.connect(reuse_if_open=True)
+            return func(*args, **kwargs)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracing.span(f"db.{func.__name__}"):
+                return await asyncio.get_running_loop().run_in_executor(
+                    executor, functools.partial(call, *args, **kwargs)
+                )
+
+        return wrapper
+
+    return decorator
+
+
+reader = _run_in(_readers)
+writer = _run_in(_writer)
+
+
+def shutdown():
+    _writer.shutdown()
+    _readers.shutdown()
+
+
+def _to_int(id) -> int | None:
+    try:
+        return int(id)
+    except (TypeError, ValueError):
+        return None
+
+
+@reader
+def get_article(id: int | str, *statuses: Status) -> Article | None:
+    key = _to_int(id)
+    if key is None:
+        return None
+    query = Article.select().where(Article.id == key)
+    if statuses:
+        query = query.where(Article.status.in_(statuses))
+    return query.first()
+
+
+@reader
+def get_articles(ids: Sequence[int | str], *statuses: Status) -> list[Article | None]:
+    # 一次 IN 查询取出所有投稿, 按传入顺序返回, 不存在或状态不符的为 None
+    keys = [_to_int(id) for id in ids]
+    query = Article.select().where(Article.id.in_([k for k in keys if k is not None]))
+    if statuses:
+        query = query.where(Article.status.in_(statuses))
+    found = {a.id: a for a in query}
+    return [found.get(k) for k in keys]
+
+
+@reader
+def find_by_tid(tid: int | str) -> Article | None:
+    return Article.select().where(Article.tid == tid).first()
+
+
+@reader
+def list_by_status(status: Status, limit: int | None = None) -> list[Article]:
+    query = Article.select().where(Article.status == status).order_by(Article.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return list(query)
+
+
+@reader
+def count_articles() -> int:
+    return Article.select().count()
+
+
+@reader
+def page_articles(
+    status: Status | None, offset: int, limit: int
+) -> tuple[int, list[Article]]:
+    query = Article.select()
+    if status is not None:
+        query = query.where(Article.status == status)
+    articles = list(query.order_by(Article.id.desc()).offset(offset).limit(limit))
+    return query.count(), articles
+
+
+@writer
+def create_article(**fields) -> int:
+    return Article.create(**fields).id
+
+
+@writer
+def update_article(id: int | str, fields: dict) -> int:
+    return Article.update(fields).where(Article.id == id).execute()
+
+
+@writer
+def update_articles(updates: dict[int, dict]):
+    # 每条投稿要改的字段不同, 但放在同一个事务里只提交一次
+    if not updates:
+        return
+    with db.atomic():
+        for id, fields in updates.items():
+            Article.update(fields).where(Article.id == id).execute()
+
+
+@writer
+def delete_articles(ids: Iterable[int]) -> int:
+    return Article.delete().where(Article.id.in_(list(ids))).execute()
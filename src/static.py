@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse
+
+import config
+import utils
+
+# 对外提供的图片只能来自这几个目录
+DATA = os.path.realpath("./data")
+THUMBS = os.path.join(DATA, "thumbs")
+STATIC_DIRS = ("help", "face")
+
+# help/ 和 face/ 的内容不会变, 启动时就把允许访问的文件列出来
+_static: dict[str, str] = {
+    os.path.join(dir, name): os.path.realpath(os.path.join(dir, name))
+    for dir in STATIC_DIRS
+    if os.path.isdir(dir)
+    for name in os.listdir(dir)
+    if os.path.isfile(os.path.join(dir, name))
+}
+
+# 路径 -> ((mtime, size), 内容哈希), 文件没变时不用重新计算
+_hashes: dict[str, tuple[tuple[int, int], str]] = {}
+_lock = threading.Lock()
+# help/ 和 face/ 中图片的 base64 编码
+_inline: dict[str, str] = {}
+
+
+def resolve(path: str) -> str | None:
+    path = os.path.normpath(path)
+    if path in _static:
+        return _static[path]
+    real = os.path.realpath(path)
+    if os.path.commonpath([real, DATA]) != DATA or not os.path.isfile(real):
+        return None
+    return real
+
+
+def digest(real: str) -> str:
+    stat = os.stat(real)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _hashes.get(real)
+    if cached and cached[0] == key:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(real, mode="rb") as f:
+        while chunk := f.read(1 << 16):
+            h.update(chunk)
+    _hashes[real] = (key, h.hexdigest())
+    return _hashes[real][1]
+
+
+def _stamp(real: str) -> str:
+    stat = os.stat(real)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def version(path: str) -> str:
+    # 加在 URL 上, 内容变化后 URL 也随之变化, 因此可以长期缓存.
+    # 在事件循环中调用, 只看修改时间和大小, 不读取文件内容
+    real = resolve(path)
+    return _stamp(real) if real else ""
+
+
+def inline(path: str) -> str | None:
+    # 足够小的图片返回 base64:// 形式, 否则返回 None, 由调用者改用 URL
+    limit = config.INLINE_IMAGE_KB * 1024
+    real = resolve(path)
+    if real is None or os.path.getsize(real) > limit:
+        return None
+    if real in _inline:
+        return _inline[real]
+    data = "base64://" + utils.read_image(real).decode()
+    if os.path.normpath(path) in _static:
+        _inline[real] = data
+    return data
+
+
+def _variant(real: str, hash: str, width: int) -> str:
+    from PIL import Image
+
+    ext = os.path.splitext(real)[1].lower() or ".png"
+    path = os.path.join(THUMBS, hash[:2], f"{hash}-{width}{ext}")
+    # 同一张图的同一尺寸只生成一次
+    with _lock:
+        if os.path.isfile(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with Image.open(real) as img:
+            if img.width > width:
+                img = img.resize(
+                    (width, max(round(img.height * width / img.width), 1)),
+                    Image.Resampling.LANCZOS,
+                )
+            tmp = f"{path}.part"
+            img.save(tmp, format=Image.registered_extensions().get(ext, "PNG"))
+        os.replace(tmp, path)
+    return path
+
+
+# 在 FastAPI 的线程池中执行, 读文件和缩放不会阻塞事件循环
+def serve(request: Request, path: str, width: int | None, v: str | None):
+    real = resolve(path)
+    if real is None:
+        raise HTTPException(status_code=404, detail="Nothing.")
+    hash = digest(real)
+    current = v is not None and v == _stamp(real)
+    if width is not None:
+        if width not in config.IMAGE_WIDTHS:
+            raise HTTPException(status_code=400, detail="Nothing.")
+        real = _variant(real, hash, width)
+
+    etag = f'"{hash[:32]}-{width or 0}"'
+    headers = {
+        "ETag": etag,
+        # 带有正确版本号的 URL 内容不会再变, 其他情况每次都要重新验证
+        "Cache-Control": (
+            "public, max-age=31536000, immutable" if current else "no-cache"
+        ),
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    # FileResponse 会处理 Range 请求
+    return FileResponse(real, headers=headers)
+
+
+def prune(before: float) -> int:
+    # 删除在 before 之前生成的缩略图, 需要时会重新生成
+    removed = 0
+    for dir, _, files in os.walk(THUMBS):
+        for name in files:
+            path = os.path.join(dir, name)
+            try:
+                if os.path.getmtime(path) < before:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
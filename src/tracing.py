@@ -0,0 +1,144 @@
+import contextvars
+import functools
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable
+
+import metrics
+
+handler_seconds = metrics.Histogram(
+    "nishikigi_handler_seconds", "各消息处理函数的耗时", labels=("handler",)
+)
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    seconds: float
+
+
+@dataclass(slots=True)
+class Trace:
+    name: str
+    started: float = field(default_factory=time.time)
+    seconds: float = 0.0
+    spans: list[Span] = field(default_factory=list)
+    closed: bool = False
+
+    def top(self, n: int = 3) -> list[tuple[str, float, int]]:
+        # 同名的调用合并, 按总耗时排序
+        totals: dict[str, list] = {}
+        for span in self.spans:
+            entry = totals.setdefault(span.name, [0.0, 0])
+            entry[0] += span.seconds
+            entry[1] += 1
+        ranked = sorted(totals.items(), key=lambda i: i[1][0], reverse=True)[:n]
+        return [(name, seconds, count) for name, (seconds, count) in ranked]
+
+    def summary(self) -> str:
+        parts = [
+            f"{name}{f' x{count}' if count > 1 else ''} {seconds:.2f}s"
+            for name, seconds, count in self.top()
+        ]
+        return f"{self.name} {self.seconds:.2f}s" + (
+            f" ({', '.join(parts)})" if parts else ""
+        )
+
+
+# 当前正在处理的消息, 通过 contextvars 传到它创建的任务里
+current: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "trace", default=None
+)
+
+
+def record(name: str, seconds: float):
+    trace = current.get()
+    if trace is not None and not trace.closed:
+        trace.spans.append(Span(name, seconds))
+
+
+@contextmanager
+def span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+class Tracer:
+    def __init__(self, slow: float, alert: float, cooldown: float, size: int):
+        self.slow = slow
+        self.alert = alert
+        self.cooldown = cooldown
+        # 最近的慢操作
+        self.traces: deque[Trace] = deque(maxlen=size)
+        # 超过 alert 时调用, 由 core 设置为发送到审核群
+        self.on_alert: Callable[[Trace], None] | None = None
+        self._alerted = 0.0
+
+    def trace(self, name: str, func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            trace = Trace(name)
+            token = current.set(trace)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                trace.seconds = time.perf_counter() - start
+                trace.closed = True
+                current.reset(token)
+                self.finish(trace)
+
+        return wrapper
+
+    def finish(self, trace: Trace):
+        handler_seconds.observe(trace.seconds, handler=trace.name)
+        if trace.seconds < self.slow:
+            return
+        self.traces.append(trace)
+        now = time.monotonic()
+        if (
+            self.alert > 0
+            and trace.seconds >= self.alert
+            and self.on_alert is not None
+            and now - self._alerted >= self.cooldown
+        ):
+            self._alerted = now
+            self.on_alert(trace)
+
+    def slowest(self, n: int = 10) -> list[Trace]:
+        return sorted(self.traces, key=lambda t: t.seconds, reverse=True)[:n]
+
+    def instrument(self, bot):
+        # 替换注册处理函数的装饰器, 之后注册的处理函数都会被计时.
+        # functools.wraps 保留了参数注解, botx 仍能按注解分发事件
+        def register(original, kind: str):
+            @functools.wraps(original)
+            def decorator(*args, **kwargs):
+                register_handler = original(*args, **kwargs)
+
+                def wrap(func):
+                    name = kwargs.get("name") or (args[0] if args else None)
+                    name = f"#{name}" if kind == "cmd" and name else func.__name__
+                    return register_handler(self.trace(name, func))
+
+                return wrap
+
+            return decorator
+
+        bot.on_cmd = register(bot.on_cmd, "cmd")
+        bot.on_msg = register(bot.on_msg, "msg")
+        bot.on_notice = register(bot.on_notice, "notice")
+
+        call_api = bot.call_api
+
+        @functools.wraps(call_api)
+        async def traced_call_api(action, *args, **kwargs):
+            with span(f"call_api {action}"):
+                return await call_api(action, *args, **kwargs)
+
+        bot.call_api = traced_call_api
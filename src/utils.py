@@ -1,9 +1,34 @@
+import asyncio
 import base64
+import time
 
 
 def read_image(path: str) -> bytes:
     with open(path, mode="br") as f:
         return base64.b64encode(f.read())
 
+
 def to_list(l):
-    return list(map(lambda a: a.id, l))
\ No newline at end of file
+    return list(map(lambda a: a.id, l))
+
+
+class RateLimiter:
+    # 按固定间隔放行, rate 为每秒次数, <= 0 表示不限制
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    def delay(self) -> float:
+        return max(self._next - time.monotonic(), 0.0)
+
+    def reserve(self) -> float:
+        # 占用下一个名额, 返回需要等待的秒数
+        now = time.monotonic()
+        wait = self._next - now
+        self._next = max(now, self._next) + self.interval
+        return max(wait, 0.0)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)